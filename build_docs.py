@@ -10,24 +10,28 @@ from __future__ import print_function
 import argparse
 import datetime
 import difflib
+import hashlib
+import io
 import multiprocessing
 import os
-import platform
 import re
 import shutil
 import sys
-import tempfile
-import types
+
+if sys.hexversion < 0x03000000:  # pragma: no cover
+    from StringIO import StringIO
+else:
+    from io import StringIO
 
 # PyPI imports
 from cogapp import Cog
-import decorator
 import docutils
 import docutils.core
 
 # Intra-package imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import pypkg.functions
+import pypkg.term_echo
 
 try:
     from pypkg.refresh_moddb import refresh_moddb
@@ -48,66 +52,120 @@ except ImportError:
 ###
 # Global variables
 ###
+MANIFEST_NAME = "docs_manifest.json"
 VALID_MODULES = [pypkg.functions.get_pkg_name()]
 PKG_DOC_SUBMODULES = pypkg.functions.get_pkg_doc_submodules()
+_REF_REGEXPS = {}
+# Equivalent to rst2html.py --exit-status=3 --verbose --strict
+_RST_SETTINGS = {"exit_status_level": 3, "halt_level": 1, "report_level": 1}
+_VALID_RST = set()
 
 
 ###
-# Helper classes
+# Functions
 ###
-@decorator.contextmanager
-def ignored(*exceptions):
+def _get_ex_msg(obj):
+    """Get exception message."""
+    return obj.value.args[0] if hasattr(obj, "value") else obj.args[0]
+
+
+def _hook_term_echo():
+    """Cache output of commands echoed in documentation via pmisc."""
     try:
-        yield
-    except exceptions:
-        pass
+        import pmisc
+    except ImportError:
+        return
+    pypkg.term_echo.hook_module(pmisc)
 
 
-class TmpFile(object):
+def _insert_files_in_rst(fname):
     """
-    Use a temporary file within context.
+    Cog-insert source files in a Sphinx file.
 
-    From pmisc package
+    Returns whether the file changed and the commands echoed in it
     """
+    # pylint: disable=W0703
+    # Cog output is regenerated in memory in a single pass (generated
+    # text is replaced, no need to delete it first) and the file is
+    # only written if its contents actually change, so that its
+    # modification time is preserved otherwise
+    with open(fname, "r") as fobj:
+        text = fobj.read()
+    _hook_term_echo()
+    cobj = Cog()
+    cobj.options.bWarnEmpty = True
+    cobj.saveIncludePath()
+    try:
+        cobj.addToIncludePath([os.path.dirname(fname)])
+        with pypkg.term_echo.recording() as specs:
+            new_text = cobj.processString(text, fname=fname)
+    except Exception as exobj:
+        raise RuntimeError(
+            "Error inserting source files in documentation file {0}:{1}{2}".format(
+                fname, os.linesep, exobj
+            )
+        )
+    finally:
+        cobj.restoreIncludePath()
+    if new_text == text:
+        return False, specs
+    pypkg.functions.atomic_write(fname, new_text)
+    return True, specs
+
+
+def _ref_regexp(pkg_name):
+    """Return compiled regular expression that matches Sphinx cross-references."""
+    # A single expression (with one group per replacement text) matches
+    # module references with a label (:py:mod:`label <pkg.module>`),
+    # module references (:py:mod:`pkg.module`), labels (:ref:`name` or
+    # :ref:`name <target>`) and classes or data (:py:class:`name`,
+    # :py:data:`name`)
+    if pkg_name not in _REF_REGEXPS:
+        pkg = re.escape(pkg_name)
+        _REF_REGEXPS[pkg_name] = re.compile(
+            ":py:mod:`(?P<label>[^`<]+?)\\s+<" + pkg + "\\.[^`>]+>`"
+            "|:py:mod:`" + pkg + "\\.(?P<mname>[^`]+)`"
+            "|:ref:`(?P<ref>[^`<]+?)(?:\\s+<[^`]+>)?`"
+            "|:py:(?:class|data):`(?P<obj>[^`]+)`"
+        )
+    return _REF_REGEXPS[pkg_name]
 
-    def __init__(self, fpointer=None, *args, **kwargs):  # noqa
-        if (
-            fpointer
-            and (not isinstance(fpointer, types.FunctionType))
-            and (not isinstance(fpointer, types.LambdaType))
-        ):
-            raise RuntimeError("Argument `fpointer` is not valid")
-        self._fname = None
-        self._fpointer = fpointer
-        self._args = args
-        self._kwargs = kwargs
-
-    def __enter__(self):  # noqa
-        fdesc, fname = tempfile.mkstemp()
-        # fdesc is an OS-level file descriptor, see problems if this
-        # is not properly closed in this post:
-        # https://www.logilab.org/blogentry/17873
-        os.close(fdesc)
-        if platform.system().lower() == "windows":  # pragma: no cover
-            fname = fname.replace(os.sep, "/")
-        self._fname = fname
-        if self._fpointer:
-            with open(self._fname, "w") as fobj:
-                self._fpointer(fobj, *self._args, **self._kwargs)
-        return self._fname
-
-    def __exit__(self, exc_type, exc_value, exc_tb):  # noqa
-        with ignored(OSError):
-            os.remove(self._fname)
-        return not exc_type is not None
 
+def _ref_repl(match):
+    """Return replacement text of a Sphinx cross-reference."""
+    return next(item for item in match.groups() if item is not None)
 
-###
-# Functions
-###
-def _get_ex_msg(obj):
-    """Get exception message."""
-    return obj.value.args[0] if hasattr(obj, "value") else obj.args[0]
+
+def _rebuild_submodule(pars):
+    """Rebuild exceptions documentation of a single module."""
+    # Messages are returned instead of printed so that the output of
+    # concurrently processed modules is not interleaved
+    test, src_dir, submodule, noption = pars
+    if noption is not None:
+        os.environ["NOPTION"] = noption
+    retcode = 0
+    msgs = []
+    smf = os.path.join(src_dir, submodule + ".py")
+    orig_file = smf + ".orig"
+    if test:
+        shutil.copy(smf, orig_file)
+    if Cog().main(["cog.py", "-e", "-o", smf + ".tmp", smf]):
+        raise RuntimeError(
+            "Error generating exceptions documentation in module {0}".format(smf)
+        )
+    move_file(smf + ".tmp", smf)
+    if test:
+        diff_list = diff(smf, orig_file)
+        if not diff_list:
+            msgs.append(("green", "   File {0} identical from original".format(smf)))
+        else:
+            msgs.append(("red", "   File {0} differs from original".format(smf)))
+            msgs.append(("none", "   Differences:"))
+            msgs.append(("none", print_diff(diff_list)))
+            copy_file(smf, smf + ".error")
+            retcode = 1
+        move_file(orig_file, smf)
+    return retcode, msgs
 
 
 def build_pkg_docs(args):
@@ -140,19 +198,42 @@ def build_pkg_docs(args):
                 )
             )
             start_time = datetime.datetime.today()
-            tmp_retcode = rebuild_module_doc(test, src_dir, tracer_dir)
+            tmp_retcode = rebuild_module_doc(test, src_dir, args.num_cpus)
             retcode = tmp_retcode if not retcode else retcode
             stop_time = datetime.datetime.today()
             print(
                 "Elapsed time: {0}".format(elapsed_time_string(start_time, stop_time))
             )
             build_moddb()
-    generate_top_level_readme(pkg_dir)
-    print("Inserting files into docstrings")
-    insert_files_in_rsts(pkg_dir)
-    cleanup(pkg_dir)
+    # Stages are skipped if none of their inputs changed since the last
+    # time they were successfully run. Sphinx build directory is not
+    # removed (unless a full build is requested) so that Sphinx reuses
+    # its doctrees cache and only re-reads modified sources. A full build
+    # also re-runs the commands whose output is echoed in the documentation
+    if args.full:
+        pypkg.term_echo.clear_cache()
+    manifest = {} if args.full else (pypkg.functions.read_cache(MANIFEST_NAME) or {})
+    inputs_hash = hash_files(docs_inputs(pkg_dir, src_dir))
+    if (manifest.get("readme", None) == inputs_hash) and os.path.exists(
+        os.path.join(pkg_dir, "README.rst")
+    ):
+        print("Documentation sources unchanged, skipping README.rst generation")
+    else:
+        generate_top_level_readme(pkg_dir)
+        print("Inserting files into docstrings")
+        insert_files_in_rsts(pkg_dir)
+        cleanup(pkg_dir)
+        inputs_hash = hash_files(docs_inputs(pkg_dir, src_dir))
+        manifest["readme"] = inputs_hash
+        pypkg.functions.write_cache(MANIFEST_NAME, manifest)
+    if (manifest.get("sphinx", None) == inputs_hash) and os.path.exists(
+        os.path.join(pkg_dir, "docs", "_build", "html", "index.html")
+    ):
+        print("Documentation sources unchanged, skipping HTML output generation")
+        return retcode
     print("Generating HTML output")
-    shutil.rmtree(os.path.join(pkg_dir, "docs", "_build"), ignore_errors=True)
+    if args.full:
+        shutil.rmtree(os.path.join(pkg_dir, "docs", "_build"), ignore_errors=True)
     cwd = os.getcwd()
     os.chdir(os.path.join(pkg_dir, "docs"))
     pypkg.functions.shcmd(
@@ -169,6 +250,8 @@ def build_pkg_docs(args):
         "Error building Sphinx documentation",
         async_stdout=True,
     )
+    manifest["sphinx"] = inputs_hash
+    pypkg.functions.write_cache(MANIFEST_NAME, manifest)
     # Copy built documentation to its own directory
     # dest_dir = os.path.join(pkg_dir, 'docs', 'html')
     # src_dir = os.path.join(pkg_dir, 'docs', '_build', 'html')
@@ -196,10 +279,11 @@ def cleanup(pkg_dir):
         elif line or ((not line) and prev_line):
             out_lines.append(line)
             prev_line = line.strip()
+    text = "\n".join(out_lines)
     with open(fname, "w") as fobj:
-        fobj.write("\n".join(out_lines))
+        fobj.write(text)
     # Check that generated file produces HTML version without errors
-    rst2html(os.path.normpath(fname))
+    validate_rst(text, os.path.normpath(fname))
 
 
 def copy_file(src, dest):
@@ -211,14 +295,6 @@ def copy_file(src, dest):
     shutil.copy(src, dest)
 
 
-def del_file(fname):
-    """Delete file."""
-    try:
-        os.remove(fname)
-    except OSError:
-        pass
-
-
 def diff(file1, file2):
     """Diff two files."""
     with open(file1, "r") as fobj1:
@@ -228,6 +304,32 @@ def diff(file1, file2):
     return list(difflib.unified_diff(flines1, flines2, fromfile=file1, tofile=file2))
 
 
+def docs_inputs(pkg_dir, src_dir):
+    """Return names of all files the documentation build depends on."""
+    ext_exclude = ["error", "orig", "pkl", "pyc", "tmp"]
+    # Sources (reStructuredText files, support modules included via
+    # incfile, data, etc.) and generated top-level README.rst file
+    fnames = list(
+        pypkg.functions.dir_tree(os.path.join(pkg_dir, "docs"), ["_build"], ext_exclude)
+    )
+    fnames.append(os.path.join(pkg_dir, "README.rst"))
+    # Package data read by Cog blocks (i.e. data/requirements.json, used
+    # to generate the requirements section of README.rst)
+    fnames.extend(
+        pypkg.functions.dir_tree(os.path.join(pkg_dir, "data"), ext_exclude=ext_exclude)
+    )
+    # Package modules (autodoc, cog-inserted examples)
+    fnames.extend(pypkg.functions.dir_tree(src_dir, ext_exclude=ext_exclude))
+    # Scripts whose output is echoed into the documentation via term_echo
+    sbin_dir = os.path.dirname(os.path.abspath(__file__))
+    fnames.extend(
+        os.path.join(sbin_dir, fname)
+        for fname in os.listdir(sbin_dir)
+        if os.path.splitext(fname)[1] in [".py", ".sh"]
+    )
+    return fnames
+
+
 def elapsed_time_string(start_time, stop_time):
     """Return a formatted string with the elapsed time between two time points."""
     delta_time = stop_time - start_time
@@ -263,6 +365,17 @@ def elapsed_time_string(start_time, stop_time):
     return (", ".join(ret_list[0:-1])) + " and " + ret_list[-1]
 
 
+def hash_files(fnames):
+    """Return hash of names and contents of a list of files."""
+    hobj = hashlib.sha1()
+    for fname in sorted(set(fnames)):
+        hobj.update(fname.encode("utf-8") if isinstance(fname, type(u"")) else fname)
+        if os.path.isfile(fname):
+            with open(fname, "rb") as fobj:
+                hobj.update(fobj.read())
+    return hobj.hexdigest()
+
+
 def insert_files_in_rsts(pkg_dir):
     """Cog-insert source files in Sphinx files."""
     fnames = [os.path.join(pkg_dir, "README.rst")]
@@ -270,21 +383,26 @@ def insert_files_in_rsts(pkg_dir):
     if os.path.exists(fname):
         fnames = [fname] + fnames
     print("Inserting source files in documentation files")
-    for fname in fnames:
-        print("   Processing file {0}".format(fname))
-        retcode = Cog().main(["cog.py", "-e", "-x", "-o", fname + ".tmp", fname])
-        if retcode:
-            raise RuntimeError(
-                "Error deleting insertion of source files in "
-                "documentation file {0}".format(fname)
-            )
-        retcode = Cog().main(["cog.py", "-e", "-o", fname + ".tmp", fname])
-        if retcode:
-            raise RuntimeError(
-                "Error inserting source files in "
-                "docstrings in module {0}".format(fname)
+    prefetch_term_echo(fnames)
+    # Files are independent of each other, process them concurrently
+    if len(fnames) > 1:
+        pool = multiprocessing.Pool(len(fnames))
+        try:
+            results = pool.map(_insert_files_in_rst, fnames)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_insert_files_in_rst(fname) for fname in fnames]
+    pypkg.term_echo.save_specs(
+        dict((fname, specs) for fname, (_, specs) in zip(fnames, results))
+    )
+    for fname, (fchanged, _) in zip(fnames, results):
+        print(
+            "   Processing file {0}{1}".format(
+                fname, "" if fchanged else " (unchanged)"
             )
-        move_file(fname + ".tmp", fname)
+        )
 
 
 def move_file(src, dest):
@@ -371,68 +489,59 @@ def print_red(text):
     print(pcolor(text, "red"))
 
 
-def rebuild_module_doc(test, src_dir, tracer_dir):  # noqa
+def prefetch_term_echo(fnames):
+    """Run commands echoed in documentation files concurrently ahead of Cog."""
+    # Commands echoed the last time the files were processed and whose
+    # output is not cached are run concurrently, the Cog pass uses their
+    # cached output. Commands added since then are run by the Cog pass
+    _hook_term_echo()
+    pypkg.term_echo.term_echo_batch(pypkg.term_echo.load_specs(fnames))
+
+
+def rebuild_module_doc(test, src_dir, num_cpus=1):  # noqa
     # pylint: disable=R0913
     retcode = 0
-    pkl_dir = tracer_dir
     submodules = PKG_DOC_SUBMODULES
-    for submodule in submodules:
-        smf = os.path.join(src_dir, submodule + ".py")
-        pkl_file = os.path.join(pkl_dir, submodule + ".pkl")
-        print_cyan("Processing module {0}".format(submodule))
-        orig_file = smf + ".orig"
-        if test:
-            shutil.copy(smf, orig_file)
-        retcode = Cog().main(["cog.py", "-e", "-o", smf + ".tmp", smf])
-        if retcode:
-            raise RuntimeError(
-                "Error generating exceptions documentation in module {0}".format(smf)
+    num_workers = min(num_cpus, len(submodules))
+    if num_workers > 1:
+        # CPUs are split between modules processed concurrently and the
+        # (py.test xdist) tracing runs within each module
+        num_trace_cpus = num_cpus // num_workers
+        noption = "-n {0}".format(num_trace_cpus) if num_trace_cpus > 1 else ""
+        print_cyan(
+            "Processing {0} modules using {1} processes".format(
+                len(submodules), num_workers
             )
-        move_file(smf + ".tmp", smf)
-        if test:
-            diff_list = diff(smf, orig_file)
-            if not diff_list:
-                print_green("   File {0} identical from original".format(smf))
-                del_file(pkl_file)
-            else:
-                print_red("   File {0} differs from original".format(smf))
-                print("   Differences:")
-                print(print_diff(diff_list))
-                copy_file(smf, smf + ".error")
-                retcode = 1
-            move_file(orig_file, smf)
-        else:
-            del_file(pkl_file)
+        )
+        # Each module is traced in a fresh process, tracing state is kept in
+        # interpreter-wide (builtins) attributes that must not be shared
+        pool = multiprocessing.Pool(num_workers, maxtasksperchild=1)
+        try:
+            results = pool.map(
+                _rebuild_submodule,
+                [(test, src_dir, item, noption) for item in submodules],
+                chunksize=1,
+            )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = (
+            _rebuild_submodule((test, src_dir, item, None)) for item in submodules
+        )
+    # Results are reported in module order regardless of completion order
+    for submodule, (sretcode, msgs) in zip(submodules, results):
+        print_cyan("Processing module {0}".format(submodule))
+        for color, msg in msgs:
+            print(pcolor(msg, color))
+        retcode = sretcode if not retcode else retcode
     return retcode
 
 
 def rst2html(ifname, desc=""):
-    """rst2html.py interface without going through command line."""
-    description = (
-        "Generates (X)HTML documents from standalone reStructuredText "
-        "sources.  " + docutils.core.default_description
-    )
-    with TmpFile() as ofname:
-        sys.argv = [
-            "rst2html.py",
-            "--exit-status=3",
-            "--verbose",
-            "--strict",
-            ifname,
-            ofname,
-        ]
-        try:
-            docutils.core.publish_cmdline(writer_name="html", description=description)
-        except (Exception, SystemExit) as exobj:
-            ex_msg = "{0}".format(_get_ex_msg(exobj))
-            raise RuntimeError(
-                (
-                    "Error validating top-level{0} README.rst"
-                    " HTML conversion:{1}{2}".format(
-                        " {0}".format(desc) if desc else "", os.linesep, ex_msg
-                    )
-                )
-            )
+    """Validate reStructuredText file conversion without going through command line."""
+    with io.open(ifname, "r", encoding="utf-8") as fobj:
+        validate_rst(fobj.read(), ifname, desc)
 
 
 def generate_top_level_readme(pkg_dir):
@@ -448,11 +557,7 @@ def generate_top_level_readme(pkg_dir):
     with open(fname, "r") as fobj:
         lines = [item.rstrip() for item in fobj.readlines()]
     pkg_name = pypkg.functions.get_pkg_name()
-    ref1_regexp = re.compile(".*:py:mod:`(.+) <" + pkg_name + ".(.+)>`.*")
-    ref2_regexp = re.compile(".*:py:mod:`" + pkg_name + ".(.+)`.*")
-    ref3_regexp = re.compile(r".*:ref:`(.+?)(\s+<.+>)*`.*")
-    ref4_regexp = re.compile(r".*:py:class:`(.+?)`.*")
-    ref5_regexp = re.compile(r".*:py:data:`(.+?)`.*")
+    ref_regexp = _ref_regexp(pkg_name)
     rst_cmd_regexp = re.compile("^\\s*.. \\S+::.*")
     indent_regexp = re.compile("^(\\s*)\\S+")
     ret = []
@@ -460,11 +565,8 @@ def generate_top_level_readme(pkg_dir):
     literalinclude = False
     remove_block = False
     for line in lines:
-        match1 = ref1_regexp.match(line)
-        match2 = ref2_regexp.match(line)
-        match3 = ref3_regexp.match(line)
-        match4 = ref4_regexp.match(line)
-        match5 = ref5_regexp.match(line)
+        # All cross-references in the line are removed in a single scan
+        ref_line, num_refs = ref_regexp.subn(_ref_repl, line)
         if line.lstrip().startswith(".. [REMOVE STOP]"):
             remove_block = False
         elif remove_block:
@@ -500,45 +602,9 @@ def generate_top_level_readme(pkg_dir):
                 ret.append(".. ]]]")
                 ret.append(".. [[[end]]]")
                 ret.append(".. [REMOVE STOP]")
-        elif match1:
-            # Remove cross-references
-            label = match1.group(1)
-            mname = match1.group(2)
-            line = line.replace(
-                ":py:mod:`{label} <".format(label=label)
-                + pkg_name
-                + ".{mname}>`".format(mname=mname),
-                label,
-            )
-            ret.append(line)
-        elif match2:
-            # Remove cross-references
-            mname = match2.group(1)
-            line = line.replace(
-                ":py:mod:`" + pkg_name + ".{mname}`".format(mname=mname), mname
-            )
-            ret.append(line)
-        elif match3:
+        elif num_refs:
             # Remove cross-references
-            mname = match3.group(1)
-            target = match3.group(2)
-            line = line.replace(
-                ":ref:`{mname}{target}`".format(
-                    mname=mname, target="" if target is None else target
-                ),
-                mname,
-            )
-            ret.append(line)
-        elif match4:
-            # Remove classes cross-references
-            mname = match4.group(1)
-            line = line.replace(":py:class:`{mname}`".format(mname=mname), mname)
-            ret.append(line)
-        elif match5:
-            # Remove constants cross-references
-            mname = match5.group(1)
-            line = line.replace(":py:data:`{mname}`".format(mname=mname), mname)
-            ret.append(line)
+            ret.append(ref_line)
         elif line.lstrip().startswith(".. literalinclude::"):
             fname = line.lstrip().replace(".. literalinclude::", "").strip()
             literalinclude = True
@@ -570,11 +636,44 @@ def generate_top_level_readme(pkg_dir):
             remove_block = True
         else:
             ret.append(line)
+    # The generated file is validated once source files are inserted
+    # and unnecessary blocks removed, see cleanup()
     fname = os.path.join(pkg_dir, "README.rst")
     with open(fname, "w") as fobj:
         fobj.write("\n".join(ret))
-    # Check that generated file produces HTML version without errors
-    rst2html(os.path.normpath(fname))
+
+
+def strip_sphinx_refs(lines, pkg_name=None):
+    """Remove Sphinx-specific cross-references from lines of text (generator)."""
+    regexp = _ref_regexp(pkg_name or pypkg.functions.get_pkg_name())
+    for line in lines:
+        yield regexp.sub(_ref_repl, line)
+
+
+def validate_rst(text, source_path=None, desc=""):
+    """Validate reStructuredText in memory, identical text is only validated once."""
+    key = hashlib.sha1(
+        text.encode("utf-8") if isinstance(text, type(u"")) else text
+    ).hexdigest()
+    if key in _VALID_RST:
+        return
+    settings = dict(_RST_SETTINGS)
+    settings["warning_stream"] = StringIO()
+    try:
+        docutils.core.publish_doctree(
+            text, source_path=source_path, settings_overrides=settings
+        )
+    except (Exception, SystemExit) as exobj:
+        ex_msg = "{0}".format(_get_ex_msg(exobj))
+        raise RuntimeError(
+            (
+                "Error validating top-level{0} README.rst"
+                " HTML conversion:{1}{2}".format(
+                    " {0}".format(desc) if desc else "", os.linesep, ex_msg
+                )
+            )
+        )
+    _VALID_RST.add(key)
 
 
 def valid_dir(value):
@@ -631,6 +730,15 @@ if __name__ == "__main__":
         ),
         action="store_true",
     )
+    PARSER.add_argument(
+        "-f",
+        "--full",
+        help=(
+            "rebuild all documentation from scratch, even if its sources "
+            "have not changed since the last build"
+        ),
+        action="store_true",
+    )
     PARSER.add_argument(
         "-n",
         "--num-cpus",
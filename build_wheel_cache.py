@@ -6,22 +6,87 @@
 
 # Standard library imports
 from __future__ import print_function
+import argparse
+import json
+from multiprocessing.pool import ThreadPool
 import os
+import re
+import shutil
 import subprocess
 import sys
+import tempfile
+
+# PyPI imports
+try:
+    import pkg_resources
+except ImportError:  # pragma: no cover
+    pkg_resources = None
+
+
+###
+# Global variables
+###
+# Packages that have to be installed before the wheel of a package can be
+# built (package name: list of package names)
+BUILD_DEPENDENCIES = {"scipy": ["numpy"]}
+# Built wheels index, keyed by package name, version and Python interpreter
+# version joined by INDEX_SEP, the value is the wheel file name
+INDEX_NAME = "wheel_index.json"
+INDEX_SEP = "|"
+# Wheelhouse index, requirement to wheel file path dictionary per Python
+# interpreter tag (i.e. py36), used for offline installs (see
+# pypkg.functions.load_requirements)
+WHEELHOUSE_NAME = "wheelhouse.json"
 
 
 ###
 # Functions
 ###
+def _build_level(name):
+    """Return scheduling level of a package, dependencies are built first."""
+    deps = BUILD_DEPENDENCIES.get(name, [])
+    return 1 + max(_build_level(dep) for dep in deps) if deps else 0
+
+
+def _find_wheel(index, wheel_dir, line, pyver):
+    """Return name of an already built wheel that satisfies a requirement."""
+    name = _req_name(line)
+    for key, fname in sorted(index.items()):
+        iname, iver, ipyver = key.split(INDEX_SEP)
+        if (
+            (iname == name)
+            and (ipyver == pyver)
+            and _satisfies(line, iver)
+            and os.path.exists(os.path.join(wheel_dir, fname))
+        ):
+            return fname
+    return None
+
+
+def _load_index(wheel_dir):
+    """Load built wheels index."""
+    fname = os.path.join(wheel_dir, INDEX_NAME)
+    if not os.path.exists(fname):
+        return {}
+    try:
+        with open(fname, "r") as fobj:
+            return json.load(fobj)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
 # This is a sub-set of the .misc.pcolor function, repeated here because
 # this script may be run right after cloning and the module may not be in
 # the Python search path
-def _os_cmd(cmd):
-    """Execute shell command and display standard output."""
-    pobj = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+def _os_cmd(cmd, env=None):
+    """Execute shell command and return return code and standard output."""
+    pobj = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env
+    )
     stdout, _ = pobj.communicate()
-    print(stdout)
+    if sys.hexversion >= 0x03000000:
+        stdout = stdout.decode("utf-8")
+    return pobj.returncode, stdout
 
 
 def _pcolor(text, color, indent=0):
@@ -44,13 +109,85 @@ def _pcolor(text, color, indent=0):
     return "{indent}{text}".format(indent=" " * indent, text=text)
 
 
-def _pip_install(pyver, pkg_name):
-    """Install package via pip."""
-    _os_cmd(
-        ["pip{0}".format(pyver), "install", "--upgrade", "--force-reinstall", pkg_name]
+def _pip_install(pars):
+    """Install packages from wheels in wheel cache."""
+    pyver, lines, wheel_dir, env = pars
+    return _os_cmd(
+        ["pip{0}".format(pyver), "install", "--no-index", "--find-links", wheel_dir]
+        + lines,
+        env,
     )
 
 
+def _pip_wheel(pars):
+    """Build wheel of a package (and its dependencies)."""
+    # Every build uses its own directory so that the wheels it produces can
+    # be indexed even when several builds run at the same time
+    pyver, line, wheel_dir, env = pars
+    # Wheels of a failed build are discarded, so that they are not indexed
+    tmp_dir = tempfile.mkdtemp(prefix="build_wheel_cache_", dir=wheel_dir)
+    try:
+        retcode, stdout = _os_cmd(
+            ["pip{0}".format(pyver), "wheel", "--wheel-dir", tmp_dir, line], env
+        )
+        fnames = []
+        if not retcode:
+            fnames = sorted(
+                item for item in os.listdir(tmp_dir) if item.endswith(".whl")
+            )
+        for fname in fnames:
+            shutil.move(os.path.join(tmp_dir, fname), os.path.join(wheel_dir, fname))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return retcode, stdout, fnames
+
+
+def _req_name(line):
+    """Return normalized package name of a requirement line."""
+    return normalize_name(re.match(r"\s*([\w.-]+)", line).group(1))
+
+
+def _run_pool(func, items, num_jobs):
+    """Run function on items concurrently, results are in items order."""
+    if not items:
+        return []
+    pool = ThreadPool(min(num_jobs, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _satisfies(line, version):
+    """Check whether a package version satisfies a requirement."""
+    if pkg_resources is None:  # pragma: no cover
+        return False
+    try:
+        req = pkg_resources.Requirement.parse(line)
+    except ValueError:
+        return False
+    return req.specifier.contains(version, prereleases=True)
+
+
+def _save_index(wheel_dir, index):
+    """Save built wheels index."""
+    fname = os.path.join(wheel_dir, INDEX_NAME)
+    with open(fname, "w") as fobj:
+        json.dump(index, fobj, indent=0, sort_keys=True)
+
+
+def normalize_name(name):
+    """Normalize package name (PEP 503)."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def wheel_name_version(fname):
+    """Return normalized package name and version of a wheel file name."""
+    tokens = os.path.basename(fname).split("-")
+    return normalize_name(tokens[0]), tokens[1]
+
+
 def which(name):
     """Search PATH for executable files with the given name."""
     # Inspired by https://twistedmatrix.com/trac/browser/tags/releases/
@@ -76,6 +213,8 @@ def load_requirements(pkg_dir, pyver):
         "tests_py{0}.pip".format(pyver),
         "docs.pip",
     ]
+    # Read the Docs build environment is Python 2.7
+    reqs_files += ["rtd.pip"] if pyver == "27" else []
     ret = []
     for rfile in [os.path.join(reqs_dir, item) for item in reqs_files]:
         with open(os.path.join(reqs_dir, rfile), "r") as fobj:
@@ -84,12 +223,17 @@ def load_requirements(pkg_dir, pyver):
     return ret
 
 
-def build_wheel_cache(pyvers):
-    """Build pip wheel cache."""
+def build_wheel_cache(pyvers, wheel_dir=None, num_jobs=4):
+    """Build pip wheel cache, return requirements whose wheels were not built."""
+    # pylint: disable=R0914
     pkg_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
     pyvers = ["2.7", "3.5", "3.6"] if not pyvers else pyvers
-    old_python_path = os.environ["PYTHONPATH"]
-    template = "Building {0} wheel cache for Python {1}"
+    wheel_dir = os.path.abspath(wheel_dir or os.getcwd())
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ""
+    index = _load_index(wheel_dir)
+    # Build jobs, (Python version, requirement, build dependencies) tuples
+    jobs = []
     for pyver in pyvers:
         pycmd = which("python{0}".format(pyver))
         if not pycmd:
@@ -99,22 +243,149 @@ def build_wheel_cache(pyvers):
         if not pipcmd:
             print("pip {0} not found".format(pyver))
             continue
-        os.environ["PYTHONPATH"] = ""
         lines = load_requirements(pkg_dir, pyver)
+        reqs = dict((_req_name(line), line) for line in lines)
         for line in lines:
-            if "numpy" in line:
-                numpy_line = line
-                break
-        else:
-            raise RuntimeError("Numpy dependency could not be found")
-        for line in lines:
+            fname = _find_wheel(index, wheel_dir, line, pyver)
+            if fname:
+                print(
+                    _pcolor(
+                        "Wheel {0} for Python {1} already built".format(line, pyver),
+                        "green",
+                    )
+                )
+                continue
+            deps = BUILD_DEPENDENCIES.get(_req_name(line), [])
+            for dep in deps:
+                if dep not in reqs:
+                    raise RuntimeError(
+                        "{0} dependency could not be found".format(dep.capitalize())
+                    )
+            jobs.append((pyver, line, [reqs[dep] for dep in deps]))
+    # Packages are built in waves, a package is built only after the wheels
+    # of the packages it needs at build time have been built (previous wave)
+    # and installed
+    template = "Building {0} wheel cache for Python {1}"
+    levels = [_build_level(_req_name(line)) for _, line, _ in jobs]
+    failed = []
+    for level in sorted(set(levels)):
+        wave = [job for job, jlevel in zip(jobs, levels) if jlevel == level]
+        installs = {}
+        for pyver, _, deps in wave:
+            installs.setdefault(pyver, set()).update(deps)
+        items = [
+            (pyver, sorted(deps), wheel_dir, env)
+            for pyver, deps in sorted(installs.items())
+            if deps
+        ]
+        # Packages whose build dependencies could not be installed are not
+        # built
+        bad_pyvers = set()
+        for (pyver, deps, _, _), (retcode, stdout) in zip(
+            items, _run_pool(_pip_install, items, num_jobs)
+        ):
+            if retcode:
+                print(
+                    _pcolor(
+                        "Build dependencies {0} for Python {1} could not be "
+                        "installed".format(", ".join(deps), pyver),
+                        "red",
+                    )
+                )
+                print(stdout)
+                bad_pyvers.add(pyver)
+        failed.extend(
+            (pyver, line)
+            for pyver, line, deps in wave
+            if deps and (pyver in bad_pyvers)
+        )
+        wave = [
+            (pyver, line, deps)
+            for pyver, line, deps in wave
+            if not (deps and (pyver in bad_pyvers))
+        ]
+        results = _run_pool(
+            _pip_wheel,
+            [(pyver, line, wheel_dir, env) for pyver, line, _ in wave],
+            num_jobs,
+        )
+        for (pyver, line, _), (retcode, stdout, fnames) in zip(wave, results):
             print(_pcolor(template.format(line, pyver), "cyan"))
-            if "scipy" in line:
-                # Install numpy before scipy otherwise pip throws an exception
-                _pip_install(pyver, numpy_line.strip())
-            _os_cmd(["pip{0}".format(pyver), "wheel", line])
-        os.environ["PYTHONPATH"] = old_python_path
+            print(stdout)
+            if retcode:
+                failed.append((pyver, line))
+            for fname in fnames:
+                name, version = wheel_name_version(fname)
+                index[INDEX_SEP.join([name, version, pyver])] = fname
+        _save_index(wheel_dir, index)
+    if failed:
+        print(_pcolor("Wheels that could not be built:", "red"))
+        for pyver, line in failed:
+            print(_pcolor("{0} for Python {1}".format(line, pyver), "red", indent=3))
+    gen_wheelhouse_index(pyvers, wheel_dir)
+    return failed
+
+
+def gen_wheelhouse_index(pyvers, wheel_dir=None):
+    """Map requirements in all requirements files to wheels in wheel cache."""
+    pkg_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    wheel_dir = os.path.abspath(wheel_dir or os.getcwd())
+    reqs_dir = os.path.join(pkg_dir, "requirements")
+    index = _load_index(wheel_dir)
+    wheelhouse = {}
+    for pyver in pyvers:
+        pytag = "py{0}".format(pyver.replace(".", ""))
+        fnames = [
+            os.path.join(reqs_dir, "{0}_{1}.pip".format(cat, pytag))
+            for cat in ["main", "tests", "docs"]
+        ] + [os.path.join(reqs_dir, item) for item in ["docs.pip", "rtd.pip"]]
+        wheelhouse[pytag] = {}
+        for fname in [item for item in fnames if os.path.exists(item)]:
+            with open(fname, "r") as fobj:
+                lines = [item.strip() for item in fobj.readlines() if item.strip()]
+            for line in lines:
+                wheel = _find_wheel(index, wheel_dir, line, pyver)
+                if wheel:
+                    wheelhouse[pytag][line] = os.path.join(wheel_dir, wheel)
+                else:
+                    print(
+                        _pcolor(
+                            "Wheel {0} for Python {1} not found".format(line, pyver),
+                            "red",
+                        )
+                    )
+    with open(os.path.join(wheel_dir, WHEELHOUSE_NAME), "w") as fobj:
+        json.dump(wheelhouse, fobj, indent=0, sort_keys=True)
 
 
 if __name__ == "__main__":
-    build_wheel_cache(sys.argv[1:])
+    PARSER = argparse.ArgumentParser(description="Build pip wheel cache")
+    PARSER.add_argument(
+        "pyvers",
+        help="Python interpreter versions (default: 2.7, 3.5 and 3.6)",
+        nargs="*",
+    )
+    PARSER.add_argument(
+        "-w",
+        "--wheel-dir",
+        help="wheel cache directory (default: current directory)",
+        default=None,
+    )
+    PARSER.add_argument(
+        "-j",
+        "--jobs",
+        help="number of wheels built concurrently (default: 4)",
+        type=int,
+        default=4,
+    )
+    PARSER.add_argument(
+        "-i",
+        "--index",
+        help="only generate wheelhouse index of already built wheels",
+        action="store_true",
+    )
+    ARGS = PARSER.parse_args()
+    if ARGS.index:
+        gen_wheelhouse_index(ARGS.pyvers or ["2.7", "3.5", "3.6"], ARGS.wheel_dir)
+    elif build_wheel_cache(ARGS.pyvers, ARGS.wheel_dir, ARGS.jobs):
+        sys.exit(1)
@@ -4,10 +4,13 @@
 # pylint: disable=C0111,C0411,C0413,E0012,E0611,E1101,E1103,F0401,W0212
 
 # Standard library imports
+import copy
 import os
 import pickle
 import sys
+import time
 import warnings
+import zlib
 
 if sys.hexversion < 0x03000000:
     import __builtin__
@@ -20,11 +23,158 @@ with warnings.catch_warnings():
     warnings.filterwarnings("ignore", category=PytestWarning)
     import pytest
 import pexdoc.exh
+import pexdoc.pinspect
+
+
+###
+# Global variables
+###
+# Callables information attributes sent from slaves to master. Only the
+# entries that are not in the callables database loaded when the slave
+# exception handler is created (and thus known to the master) are sent
+_CALLABLES_DICTS = [
+    "_callables_db",
+    "_reverse_callables_db",
+    "_modules_dict",
+    "_fnames",
+]
+_CALLABLES_LISTS = ["_module_names", "_class_names"]
+_CALLABLES_BASELINE = {}
+# Per-slave merge statistics, (node id, merge time in seconds, message size
+# in bytes, new exception records, new callables, error message) tuples. The
+# error message is None if the slave exception handler was merged
+_MERGE_STATS = []
+_UNKNOWN_CALL = object()
 
 
 ###
 # Functions
 ###
+def _count_records(obj):
+    """Return number of exception records of an exception handler."""
+    return sum(
+        len(entry["function"])
+        for fdict in obj._ex_dict.values()
+        for entry in fdict.values()
+    )
+
+
+def _decode_exh(data):
+    """Build exception handler from its compact serialization."""
+    payload = pickle.loads(zlib.decompress(data))
+    obj = pexdoc.exh.ExHandle(
+        full_cname=payload["full_cname"], exclude=payload["exclude"], _copy=True
+    )
+    obj._ex_dict = payload["ex_dict"]
+    obj._clut = payload["clut"]
+    obj._callables_obj = pexdoc.pinspect.Callables()
+    for attr in _CALLABLES_DICTS + _CALLABLES_LISTS:
+        setattr(obj._callables_obj, attr, payload[attr])
+    return obj
+
+
+def _dedupe_callables(master, obj):
+    """Drop callables of an exception handler already in master handler."""
+    mcobj = master._callables_obj
+    cobj = obj._callables_obj
+    for attr in _CALLABLES_DICTS:
+        mdict = getattr(mcobj, attr)
+        setattr(
+            cobj,
+            attr,
+            dict(
+                (key, value)
+                for key, value in getattr(cobj, attr).items()
+                if (key not in mdict) or (mdict[key] != value)
+            ),
+        )
+    for attr in _CALLABLES_LISTS:
+        mset = set(getattr(mcobj, attr))
+        setattr(cobj, attr, [item for item in getattr(cobj, attr) if item not in mset])
+
+
+def _dedupe_ex_dict(master, obj):
+    """Drop exception records of an exception handler already in master handler."""
+    rclut = dict((value, key) for key, value in obj._clut.items())
+    for okey in list(obj._ex_dict.keys()):
+        mfdict = master._ex_dict.get(okey, {})
+        for fkey in list(obj._ex_dict[okey].keys()):
+            if fkey not in mfdict:
+                continue
+            mraised = dict(zip(mfdict[fkey]["function"], mfdict[fkey]["raised"]))
+            entry = obj._ex_dict[okey][fkey]
+            keep = []
+            for func, raised in zip(entry["function"], entry["raised"]):
+                mfunc = _master_call(master, obj, rclut, func)
+                if (mfunc not in mraised) or (raised and (not mraised[mfunc])):
+                    keep.append((func, raised))
+            if keep:
+                entry["function"] = [func for func, _ in keep]
+                entry["raised"] = [raised for _, raised in keep]
+            else:
+                del obj._ex_dict[okey][fkey]
+        if not obj._ex_dict[okey]:
+            del obj._ex_dict[okey]
+
+
+def _encode_exh(obj):
+    """Serialize exception handler, only callables traced by the slave are sent."""
+    cobj = obj._callables_obj
+    payload = {
+        "full_cname": obj._full_cname,
+        "exclude": obj._exclude,
+        "ex_dict": obj._ex_dict,
+        "clut": obj._clut,
+    }
+    for attr in _CALLABLES_DICTS:
+        baseline = _CALLABLES_BASELINE.get(attr, {})
+        payload[attr] = dict(
+            (key, value)
+            for key, value in getattr(cobj, attr).items()
+            if (key not in baseline) or (baseline[key] != value)
+        )
+    for attr in _CALLABLES_LISTS:
+        baseline = _CALLABLES_BASELINE.get(attr, set())
+        payload[attr] = [item for item in getattr(cobj, attr) if item not in baseline]
+    return zlib.compress(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+
+
+def _master_call(master, obj, rclut, call):
+    """Encode an exception handler callable path with master handler tokens."""
+    if (call is None) or (not master._full_cname):
+        return call
+    separator = obj._callables_separator
+    tokens = [master._clut.get(rclut.get(token)) for token in call.split(separator)]
+    if None in tokens:
+        # Callable path not in master handler
+        return _UNKNOWN_CALL
+    return separator.join(tokens)
+
+
+def _master_config():
+    """Return exception handler settings sent by master to slaves."""
+    return (
+        getattr(__builtin__, "_EXDOC_FULL_CNAME", False),
+        getattr(__builtin__, "_EXDOC_EXCLUDE", None),
+    )
+
+
+def _set_callables_baseline(obj):
+    """Record callables information known to master."""
+    cobj = obj._callables_obj
+    for attr in _CALLABLES_DICTS:
+        _CALLABLES_BASELINE[attr] = dict(getattr(cobj, attr))
+    for attr in _CALLABLES_LISTS:
+        _CALLABLES_BASELINE[attr] = set(getattr(cobj, attr))
+
+
+def _slave_input(config, name, default):
+    """Return value sent by master to slave."""
+    if name in config.slaveinput:
+        return pickle.loads(config.slaveinput[name])
+    return default
+
+
 def log(line, append=True):
     """Debug xdist."""
     with open(
@@ -33,6 +183,42 @@ def log(line, append=True):
         fobj.write("{0}\n".format(line))
 
 
+def merge_exh(obj):
+    """
+    Fold an exception handler into the master exception handler.
+
+    Exception records and callables already in the master exception handler
+    are dropped from the handler before merging. The master exception handler
+    is the only element of the __builtin__._EXH_LIST list; if it does not
+    exist it is created from the global exception handler (if compatible)
+    or from the handler itself. Returns the number of new exception records
+    and of new callables merged, or None (and nothing is merged) if the
+    handler settings are not the ones sent by master to slaves
+    """
+    if (obj._full_cname, obj._exclude) != _master_config():
+        return None
+    exh_list = getattr(__builtin__, "_EXH_LIST", None)
+    if exh_list:
+        master = exh_list[0]
+    else:
+        # Slaves only send callables not in the callables database file
+        # loaded by master exception handler, start from a copy of it
+        master = pexdoc.exh.get_exh_obj()
+        if (
+            (master is None)
+            or (master._full_cname != obj._full_cname)
+            or (master._exclude != obj._exclude)
+        ):
+            setattr(__builtin__, "_EXH_LIST", [obj])
+            return _count_records(obj), len(obj._callables_obj._callables_db)
+        master = copy.copy(master)
+        setattr(__builtin__, "_EXH_LIST", [master])
+    _dedupe_callables(master, obj)
+    _dedupe_ex_dict(master, obj)
+    master += obj
+    return _count_records(obj), len(obj._callables_obj._callables_db)
+
+
 def pytest_configure(config):
     """Configure Pytest, both slave and master."""
     if not hasattr(config, "slaveinput"):  # Master configuration
@@ -52,62 +238,100 @@ def pytest_configure_node(node):
         )
 
 
+def pytest_sessionfinish(session, exitstatus):
+    """Fail session if an exception handler could not be merged."""
+    # pylint: disable=W0613
+    # Exception documentation built from the session would silently miss
+    # the exception records of the slave(s) whose handler was not merged
+    if any(item[-1] for item in _MERGE_STATS) and (not session.exitstatus):
+        session.exitstatus = 1
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Report exception handlers merge statistics and errors."""
+    # Merge errors are always reported, statistics only in verbose mode
+    verbose = terminalreporter.config.option.verbose > 0
+    stats = [item for item in _MERGE_STATS if verbose or item[-1]]
+    if stats:
+        terminalreporter.write_sep("-", "exception handlers merge")
+        for node_id, etime, nbytes, nrecords, ncallables, merge_error in stats:
+            if merge_error:
+                terminalreporter.write_line(
+                    "{0}: exception handler not merged, {1}".format(
+                        node_id, merge_error
+                    ),
+                    red=True,
+                )
+                continue
+            terminalreporter.write_line(
+                "{0}: {1} bytes, {2} exception records, {3} callables, "
+                "{4:.3f} seconds".format(node_id, nbytes, nrecords, ncallables, etime)
+            )
+
+
 def pytest_testnodedown(node, error):
     """Integrate received exception handler form sub-process into main one."""
     if error:
         raise RuntimeError("Slave node reported an error")
     if "msg" in node.slaveoutput:
-        obj = pickle.loads(node.slaveoutput["msg"])
-        if not hasattr(__builtin__, "_EXH_LIST"):
-            setattr(__builtin__, "_EXH_LIST", [obj])
-        else:
-            getattr(__builtin__, "_EXH_LIST").append(obj)
+        # Handlers are merged as they arrive, the list only has one element
+        start_time = time.time()
+        msg = node.slaveoutput["msg"]
+        merge_error = None
+        counts = merge_exh(_decode_exh(msg))
+        if counts is None:
+            # Other slaves are still merged, the session fails when it ends
+            counts = (0, 0)
+            merge_error = "incompatible exception handler settings"
+        nrecords, ncallables = counts
+        _MERGE_STATS.append(
+            (
+                node.gateway.id,
+                time.time() - start_time,
+                len(msg),
+                nrecords,
+                ncallables,
+                merge_error,
+            )
+        )
 
 
-@pytest.fixture(autouse=True, scope="module")
-def exhobj(request):
+@pytest.fixture(autouse=True, scope="session")
+def slave_exhobj(request):
     """
-    Get global exception handler in sub-process and send it after tests done.
+    Create exception handler in sub-process and send it after tests done.
 
-    This fixture runs in the slave session with NO connection to master except
-    through slaveinput/slaveoutput
+    The handler (and the callables database it loads) is created once per
+    slave session. This fixture runs in the slave session with NO connection
+    to master except through slaveinput/slaveoutput
     """
-    xdist_run = hasattr(request.config, "slaveinput")
+    if not hasattr(request.config, "slaveinput"):
+        return None
+    obj = pexdoc.exh.ExHandle(
+        full_cname=_slave_input(request.config, "full_cname", False),
+        exclude=_slave_input(request.config, "exclude", None),
+        callables_fname=_slave_input(request.config, "callables_fname", None),
+    )
+    _set_callables_baseline(obj)
+    setattr(__builtin__, "_EXH", obj)
 
     def fin():
         """Tear down function."""
-        if hasattr(request.config, "slaveoutput") and hasattr(
-            request.module.__builtin__, "_EXH"
-        ):
-            request.config.slaveoutput["msg"] = pickle.dumps(
-                getattr(request.module.__builtin__, "_EXH")
-            )
+        # Session handler is sent even if a test module replaced or deleted
+        # the global one, exceptions traced with another handler are not
+        request.config.slaveoutput["msg"] = _encode_exh(obj)
 
     request.addfinalizer(fin)
-    if xdist_run:  # sub-process
-        modname = "__builtin__" if sys.hexversion < 0x03000000 else "builtins"
-        if not hasattr(request.module, "__builtin__"):
-            setattr(request.module, "__builtin__", __import__(modname))
-        exclude = (
-            pickle.loads(request.config.slaveinput["exclude"])
-            if "exclude" in request.config.slaveinput
-            else None
-        )
-        full_cname = (
-            pickle.loads(request.config.slaveinput["full_cname"])
-            if "full_cname" in request.config.slaveinput
-            else False
-        )
-        callables_fname = (
-            pickle.loads(request.config.slaveinput["callables_fname"])
-            if "callables_fname" in request.config.slaveinput
-            else None
-        )
+    return obj
 
-        setattr(
-            request.module.__builtin__,
-            "_EXH",
-            pexdoc.exh.ExHandle(
-                full_cname=full_cname, exclude=exclude, callables_fname=callables_fname
-            ),
-        )
+
+@pytest.fixture(autouse=True, scope="module")
+def exhobj(request, slave_exhobj):
+    """Make sub-process exception handler available to test module."""
+    if slave_exhobj is not None:
+        if not hasattr(request.module, "__builtin__"):
+            setattr(request.module, "__builtin__", __builtin__)
+        # Exception handler may have been replaced or deleted by a previous
+        # test module
+        setattr(__builtin__, "_EXH", slave_exhobj)
+    return slave_exhobj
@@ -5,12 +5,74 @@
 
 # Standard library imports
 from __future__ import print_function
+import codecs
+import collections
 import glob
 import io
 import json
 import os
+import re
+import shutil
+import signal
 import subprocess
 import sys
+import threading
+import types
+
+if sys.hexversion < 0x03000000:  # pragma: no cover
+    from urllib import pathname2url
+    from urlparse import urljoin
+else:
+    from urllib.parse import urljoin
+    from urllib.request import pathname2url
+
+
+###
+# Global variables
+###
+# Setup commands that build (or publish) distributions
+_DIST_COMMANDS = frozenset(
+    [
+        "bdist",
+        "bdist_dumb",
+        "bdist_egg",
+        "bdist_msi",
+        "bdist_rpm",
+        "bdist_wheel",
+        "bdist_wininst",
+        "register",
+        "sdist",
+        "upload",
+    ]
+)
+# Seconds to wait for command output after the command is killed on timeout
+_KILL_GRACE_PERIOD = 1
+# Partial output lines longer than this are passed on as-is, so that tools
+# that draw progress bars do not grow the streaming buffer without bound
+_MAX_PARTIAL_LINE = 65536
+_PKGDATA_CACHE = {}
+_PKGDATA_LOCATIONS = {}
+# Package meta-data module is normally one directory below the repository
+# root, the search does not go deeper than this many directory levels
+_PKGDATA_SEARCH_DEPTH = 3
+# Directories that never contain the package meta-data module but that can
+# be very large (build artifacts, documentation output, data, etc.)
+_PKGDATA_SEARCH_EXCLUDE = frozenset(
+    [
+        "__pycache__",
+        "build",
+        "data",
+        "dist",
+        "docs",
+        "htmlcov",
+        "node_modules",
+        "requirements",
+        "tests",
+    ]
+)
+_REQUIREMENTS_CACHE = {}
+_REQUIREMENTS_CATS = ["main", "tests", "docs", "rtd"]
+_WHEELHOUSE_CACHE = {}
 
 
 ###
@@ -66,24 +128,216 @@ else:
         return obj
 
 
+def _file_sig(fname):
+    """Return file signature used to validate persistent cache entries."""
+    try:
+        fstat = os.stat(fname)
+    except OSError:
+        return None
+    return [fstat.st_mtime, fstat.st_size]
+
+
+def _git_ignored(root):
+    """Return files and directories ignored by Git, relative to root directory."""
+    try:
+        proc = subprocess.Popen(
+            [
+                "git",
+                "ls-files",
+                "-z",
+                "--others",
+                "--ignored",
+                "--exclude-standard",
+                "--directory",
+            ],
+            cwd=root,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except OSError:
+        return frozenset()
+    stdout, _ = proc.communicate()
+    if proc.returncode:
+        return frozenset()
+    if sys.hexversion >= 0x03000000:
+        stdout = stdout.decode("utf-8")
+    # Ignored directories are listed once, with a trailing separator
+    return frozenset(os.path.normpath(item) for item in stdout.split("\0") if item)
+
+
+def _has_pkgdata(fnames):
+    """Return True if a list of file names includes the package meta-data module."""
+    return any(os.path.splitext(fname)[0] == "pkgdata" for fname in fnames)
+
+
+def _kill_process_tree(proc):
+    """Kill a process and, on POSIX, its process group."""
+    if os.name == "posix":
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            return
+        except OSError:
+            pass
+    proc.kill()
+
+
+def _load_wheelhouse():
+    """Load wheelhouse index pointed to by the PYPKG_WHEELHOUSE variable."""
+    fname = os.environ.get("PYPKG_WHEELHOUSE", "")
+    if not fname:
+        return {}
+    if os.path.isdir(fname):
+        fname = os.path.join(fname, "wheelhouse.json")
+    if fname not in _WHEELHOUSE_CACHE:
+        try:
+            with io.open(fname, "r") as fobj:
+                _WHEELHOUSE_CACHE[fname] = json.load(fobj)
+        except (IOError, OSError, ValueError):
+            _WHEELHOUSE_CACHE[fname] = {}
+    return _WHEELHOUSE_CACHE[fname]
+
+
+def _stream_output(fobj, tail, callback, echo, errors):
+    """Read and decode command output incrementally, line by line."""
+    # pylint: disable=R0913
+    # An exception raised by the callback is stored (and the callback is not
+    # called again) but output is still drained, otherwise the command could
+    # block forever once the pipe buffer is full
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    fdesc = fobj.fileno()
+    partial = ""
+    while True:
+        data = os.read(fdesc, 65536)
+        text = decoder.decode(data, not data)
+        if text and echo:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        lines = (partial + text).split("\n")
+        partial = lines.pop()
+        lines = [line + "\n" for line in lines]
+        if partial and ((not data) or (len(partial) > _MAX_PARTIAL_LINE)):
+            lines.append(partial)
+            partial = ""
+        for line in lines:
+            tail.append(line)
+            if callback and (not errors):
+                try:
+                    callback(line)
+                except Exception as exobj:  # pylint: disable=W0703
+                    errors.append(exobj)
+        if not data:
+            break
+    fobj.close()
+
+
+def _tag_tuples(obj):
+    """Replace tuples in an object by JSON-serializable tagged dictionaries."""
+    if isinstance(obj, tuple):
+        return {"__tuple__": [_tag_tuples(item) for item in obj]}
+    if isinstance(obj, list):
+        return [_tag_tuples(item) for item in obj]
+    if isinstance(obj, dict):
+        return dict((key, _tag_tuples(value)) for key, value in obj.items())
+    return obj
+
+
+def _untag_tuples(obj):
+    """Restore tuples replaced by _tag_tuples."""
+    if isinstance(obj, list):
+        return [_untag_tuples(item) for item in obj]
+    if isinstance(obj, dict):
+        if list(obj.keys()) == ["__tuple__"]:
+            return tuple(_untag_tuples(item) for item in obj["__tuple__"])
+        return dict((key, _untag_tuples(value)) for key, value in obj.items())
+    return obj
+
+
+def _wheel_requirement(line, wheel):
+    """Return requirement that installs a package from a local wheel."""
+    spec, _, marker = line.partition(";")
+    name = re.match(r"\s*([\w.-]+)", spec).group(1)
+    url = urljoin("file:", pathname2url(os.path.abspath(wheel)))
+    return "{0} @ {1}{2}".format(name, url, " ; " + marker.strip() if marker else "")
+
+
+def atomic_write(fname, text):
+    """Write file via a temporary file so that readers never see partial data."""
+    # Symbolic links are followed (the link target is written) and file
+    # permissions are preserved
+    fname = os.path.realpath(fname)
+    tmp_fname = "{0}.{1}.{2}.tmp".format(
+        fname, os.getpid(), threading.current_thread().ident
+    )
+    with open(tmp_fname, "w") as fobj:
+        fobj.write(text)
+    if os.path.exists(fname):
+        shutil.copymode(fname, tmp_fname)
+    if sys.hexversion >= 0x03030000:
+        os.replace(tmp_fname, fname)
+    else:  # pragma: no cover
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rename(tmp_fname, fname)
+
+
 def dir_tree(root, dir_exclude=None, ext_exclude=None):
     """Return all files at or under root directory."""
-    ext_exclude = [] if ext_exclude is None else ext_exclude
-    ext_exclude = ["." + item for item in ext_exclude]
-    dir_exclude = [] if dir_exclude is None else dir_exclude
-    dir_exclude = [os.path.join(root, item) for item in dir_exclude]
-    for dname, _, fnames in os.walk(root):
-        for fname in fnames:
-            _, ext = os.path.splitext(fname)
-            if any([dname.startswith(item) for item in dir_exclude]):
-                continue
-            if ext not in ext_exclude:
-                yield os.path.join(dname, fname)
-
-
-def gen_manifest(make_wheel=False):
+    return iter_tree(root, dir_exclude, ext_exclude)
+
+
+def find_pkgdata(start_dir=None, depth=_PKGDATA_SEARCH_DEPTH):
+    """Return directory where package meta-data module is, None if not found."""
+    # Search is breadth-first so that it stops at the shallowest match,
+    # and it is bounded in depth and pruned of dot-directories (.git,
+    # .tox, etc.) and of known large directories. The location found is
+    # persisted so that subsequent processes do not search at all
+    start_dir = os.path.abspath(
+        start_dir or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if start_dir in _PKGDATA_LOCATIONS:
+        return _PKGDATA_LOCATIONS[start_dir]
+    locator = read_cache("locator.json")
+    locator = locator if isinstance(locator, dict) else {}
+    ret = locator.get(start_dir, None)
+    if (not ret) or (not os.path.isdir(ret)) or (not _has_pkgdata(os.listdir(ret))):
+        ret = None
+        level = [start_dir]
+        for _ in range(depth + 1):
+            next_level = []
+            for dirpath in level:
+                try:
+                    names = sorted(os.listdir(dirpath))
+                except OSError:
+                    continue
+                fnames = [
+                    name
+                    for name in names
+                    if os.path.isfile(os.path.join(dirpath, name))
+                ]
+                if _has_pkgdata(fnames):
+                    ret = dirpath
+                    break
+                next_level.extend(
+                    os.path.join(dirpath, name)
+                    for name in names
+                    if (name not in fnames)
+                    and (not name.startswith("."))
+                    and (name not in _PKGDATA_SEARCH_EXCLUDE)
+                    and (not name.endswith(".egg-info"))
+                )
+            if ret or (not next_level):
+                break
+            level = next_level
+        if ret:
+            locator[start_dir] = ret
+            write_cache("locator.json", locator)
+    _PKGDATA_LOCATIONS[start_dir] = ret
+    return ret
+
+
+def gen_manifest(make_wheel=False, pkg_dir=None):
     """Generate MANIFEST.in file."""
-    pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pkg_dir = pkg_dir or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     fdata = json_load(os.path.join("data", "data_files.json"))
     ret = [
         "# MANIFEST.in",
@@ -116,12 +370,19 @@ def gen_manifest(make_wheel=False):
         fobj.writelines("\n".join(ret))
 
 
+def get_cache_fname(name):
+    """Return persistent cache file name, None if caching is disabled."""
+    if os.environ.get("PYPKG_NO_CACHE", ""):
+        return None
+    pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cache_dir = os.environ.get("PYPKG_CACHE_DIR", os.path.join(pkg_dir, ".pypkg_cache"))
+    return os.path.join(cache_dir, name)
+
+
 def get_coverage_exclude_files():
     """Return package entry points."""
     pkg_name = get_pkg_name()
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     try:
         return [item.format(PKG_NAME=pkg_name) for item in pkgdata.COV_EXCLUDE_FILES]
     except:
@@ -130,9 +391,7 @@ def get_coverage_exclude_files():
 
 def get_entry_points():
     """Return package entry points."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     try:
         return pkgdata.ENTRY_POINTS
     except:
@@ -141,9 +400,7 @@ def get_entry_points():
 
 def get_pkg_copyright_start():
     """Return supported Python interpreter versions."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     return pkgdata.COPYRIGHT_START
 
 
@@ -167,17 +424,13 @@ def get_pkg_data_files(share_dir):
 
 def get_pkg_desc():
     """Return short package description."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     return pkgdata.PKG_DESC
 
 
 def get_pkg_doc_submodules():
     """Return package documentation submodules."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     try:
         return pkgdata.PKG_DOC_SUBMODULES
     except:
@@ -186,9 +439,7 @@ def get_pkg_doc_submodules():
 
 def get_pkg_long_desc():
     """Return long package description."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     try:
         return pkgdata.PKG_LONG_DESC
     except:
@@ -197,24 +448,15 @@ def get_pkg_long_desc():
 
 def get_pkg_name():
     """Return package name."""
-    stem = "pkgdata"
-    start_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    for (dirpath, _, fnames) in os.walk(start_dir):
-        # Ignore .tox, .git and other directories
-        if dirpath[len(start_dir) + 1 :].startswith("."):
-            continue
-        #
-        for fname in fnames:
-            if os.path.splitext(os.path.basename(fname))[0] == stem:
-                return os.path.basename(dirpath)
+    pkgdata_dir = find_pkgdata()
+    if pkgdata_dir:
+        return os.path.basename(pkgdata_dir)
     return os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
 def get_pkg_pipeline_id():
     """Return Microsoft Azure Pipelines ID."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     try:
         return pkgdata.PKG_PIPELINE_ID
     except:
@@ -223,9 +465,7 @@ def get_pkg_pipeline_id():
 
 def get_pkg_submodules():
     """Return package submodules."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     try:
         return pkgdata.PKG_SUBMODULES
     except:
@@ -234,17 +474,101 @@ def get_pkg_submodules():
 
 def get_pkg_version():
     """Return supported Python interpreter versions."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     return pkgdata.__version__
 
 
+def get_pkgdata():
+    """Return package meta-data module, loaded only once per process."""
+    if "obj" in _PKGDATA_CACHE:
+        return _PKGDATA_CACHE["obj"]
+    # The on-disk cache avoids finding the package source directory and
+    # importing the meta-data module, it is valid as long as the module
+    # file has not been modified
+    cache = read_cache("pkgdata.json")
+    fname = cache.get("fname", "") if isinstance(cache, dict) else ""
+    if fname and (_file_sig(fname) == cache.get("sig", None)):
+        obj = types.ModuleType("pkgdata")
+        obj.__file__ = fname
+        for name, value in _untag_tuples(cache["data"]).items():
+            setattr(obj, name, value)
+    else:
+        src_dir = get_src_dir()
+        if src_dir not in sys.path:
+            sys.path.append(src_dir)
+        import pkgdata as obj
+
+        fname = os.path.join(src_dir, "pkgdata.py")
+        data = dict(
+            (name, getattr(obj, name))
+            for name in dir(obj)
+            if name.isupper() or (name == "__version__")
+        )
+        # Tuples (i.e. VERSION_INFO) are tagged so that they are not turned
+        # into lists, data that does not survive the JSON round-trip
+        # unchanged (i.e. dictionaries with non-string keys) is not cached
+        try:
+            tagged = _tag_tuples(data)
+            cacheable = _untag_tuples(json.loads(json.dumps(tagged))) == data
+        except (TypeError, ValueError):
+            cacheable = False
+        if cacheable:
+            write_cache(
+                "pkgdata.json",
+                {"fname": fname, "sig": _file_sig(fname), "data": tagged},
+            )
+    _PKGDATA_CACHE["obj"] = obj
+    return obj
+
+
+def get_requirements_model():
+    """
+    Return package requirements model, loaded once per process.
+
+    The model is a (pyvers, pkgs, cats, matrix) named tuple where pyvers is
+    the list of supported Python interpreter tags (i.e. py36), pkgs is the
+    requirements dictionary of data/requirements.json, cats maps every package
+    to its list of categories and matrix maps every package required in a
+    category other than rtd to a dictionary of Python interpreter tag and
+    package version specification, with an entry for every interpreter the
+    package is required for. The model is shared, it must not be modified
+    """
+    if "obj" in _REQUIREMENTS_CACHE:
+        return _REQUIREMENTS_CACHE["obj"]
+    pyvers = ["py{0}".format(item.replace(".", "")) for item in get_supported_interps()]
+    pkgs = json_load(os.path.join("data", "requirements.json"))
+    cats = {}
+    matrix = {}
+    for pkg_name, pkg_dict in pkgs.items():
+        cats[pkg_name] = (
+            pkg_dict["cat"] if isinstance(pkg_dict["cat"], list) else [pkg_dict["cat"]]
+        )
+        for cat in cats[pkg_name]:
+            if cat not in _REQUIREMENTS_CATS:
+                raise RuntimeError("Category {0} not recognized".format(cat))
+        # Read the Docs versions are validated by gen_req_files, the build
+        # environment (Python 2.7) need not be a supported interpreter
+        if all(cat == "rtd" for cat in cats[pkg_name]):
+            continue
+        if isinstance(pkg_dict["ver"], dict):
+            for pyver in pkg_dict["ver"]:
+                if pyver not in pyvers:
+                    raise RuntimeError(
+                        "Python version {0} not recognized".format(pyver)
+                    )
+            matrix[pkg_name] = dict(pkg_dict["ver"])
+        else:
+            matrix[pkg_name] = dict((pyver, pkg_dict["ver"]) for pyver in pyvers)
+    obj = collections.namedtuple("ReqModel", ["pyvers", "pkgs", "cats", "matrix"])(
+        pyvers, pkgs, cats, matrix
+    )
+    _REQUIREMENTS_CACHE["obj"] = obj
+    return obj
+
+
 def get_sphinx_extensions():
     """Return Sphinx extensions used by package."""
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     try:
         return pkgdata.SPHINX_EXTENSIONS
     except:
@@ -282,13 +606,71 @@ def get_src_dir():
 
 def get_supported_interps():
     """Return supported Python interpreter versions."""
-    # pylint: disable=W0122
-    sys.path.append(get_src_dir())
-    import pkgdata
-
+    pkgdata = get_pkgdata()
     return pkgdata.SUPPORTED_INTERPS
 
 
+def iter_tree(root, dir_exclude=None, ext_exclude=None, gitignore=False):
+    """
+    Return all files at or under root directory.
+
+    Directories in dir_exclude (paths relative to root) are pruned, not
+    descended into, and files with an extension (without the leading dot)
+    in ext_exclude are omitted. If gitignore is True files and directories
+    ignored by Git (i.e. untracked build output) are omitted too. Symbolic
+    links to directories are not followed
+    """
+    # Exclusions are compared against normalized paths relative to root, so
+    # that they match irrespective of how root is spelled (".", "./", etc.)
+    ext_exclude = frozenset("." + item for item in (ext_exclude or []))
+    dir_exclude = frozenset(os.path.normpath(item) for item in (dir_exclude or []))
+    ignored = _git_ignored(root) if gitignore else frozenset()
+    scandir = getattr(os, "scandir", None)
+    if scandir is None:  # pragma: no cover
+        pruned = dir_exclude | ignored
+        for dname, dnames, fnames in os.walk(root):
+            rel_dname = os.path.relpath(dname, root)
+            dnames[:] = [
+                item
+                for item in dnames
+                if os.path.normpath(os.path.join(rel_dname, item)) not in pruned
+            ]
+            for fname in fnames:
+                if (os.path.splitext(fname)[1] not in ext_exclude) and (
+                    os.path.normpath(os.path.join(rel_dname, fname)) not in ignored
+                ):
+                    yield os.path.join(dname, fname)
+        return
+    # Depth-first, pre-order traversal (same order as os.walk) of (directory,
+    # directory relative to root) tuples
+    stack = [(root, "")]
+    while stack:
+        dname, rel_dname = stack.pop()
+        dnames = []
+        try:
+            entries = sorted(scandir(dname), key=lambda item: item.name)
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                rel_path = os.path.join(rel_dname, entry.name)
+                if (
+                    (not entry.is_symlink())
+                    and (rel_path not in dir_exclude)
+                    and (rel_path not in ignored)
+                ):
+                    dnames.append((os.path.join(dname, entry.name), rel_path))
+            elif (os.path.splitext(entry.name)[1] not in ext_exclude) and (
+                (not ignored) or (os.path.join(rel_dname, entry.name) not in ignored)
+            ):
+                yield os.path.join(dname, entry.name)
+        stack.extend(reversed(dnames))
+
+
 def json_load(fname):
     """Load JSON file."""
     pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -316,7 +698,17 @@ def load_requirements(pkg_dir, pyver, cat="source"):
         with open(os.path.join(reqs_dir, fname), "r") as fobj:
             lines = [item.strip() for item in fobj.readlines() if item.strip()]
         ret.extend(lines)
-    return ret
+    # Requirements are resolved to local wheels (no network access needed)
+    # if the PYPKG_WHEELHOUSE environment variable points to a wheelhouse
+    # index, generated with build_wheel_cache.py. Local file references must
+    # not end up in the metadata of distributions that are published
+    if _DIST_COMMANDS.intersection(sys.argv[1:]):
+        return ret
+    wheels = _load_wheelhouse().get("py{0}".format(pyver), {})
+    return [
+        _wheel_requirement(line, wheels[line]) if line in wheels else line
+        for line in ret
+    ]
 
 
 def pcolor(text, color, indent=0):
@@ -353,8 +745,22 @@ def python_version(hver):
     return "{major}.{minor}".format(major=int(hver[:-2]), minor=int(hver[-2:]))
 
 
+def read_cache(name):
+    """Return data stored in a persistent cache file, None if not available."""
+    fname = get_cache_fname(name)
+    if (not fname) or (not os.path.exists(fname)):
+        return None
+    try:
+        with io.open(fname, "r") as fobj:
+            return _unicode_to_ascii(json.load(fobj))
+    except (IOError, OSError, ValueError):
+        return None
+
+
 def shcmd(cmd_list, exmsg, async_stdout=False):
     """Execute command piping STDERR to STDOUT."""
+    if async_stdout:
+        return shcmd_stream(cmd_list, exmsg)
     try:
         proc = subprocess.Popen(
             cmd_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
@@ -362,25 +768,90 @@ def shcmd(cmd_list, exmsg, async_stdout=False):
     except:
         print("COMMAND: {0}".format(" ".join(cmd_list)))
         raise
-    while async_stdout:
-        if sys.hexversion < 0x03000000:
-            line = proc.stdout.readline()
-        else:
-            line = proc.stdout.readline().decode("utf-8")
-        if (line == "") and (proc.poll() is not None):
-            break
-        sys.stdout.write(line)
-        sys.stdout.flush()
-    stdout, stderr = proc.communicate()
+    stdout, _ = proc.communicate()
     retcode = proc.returncode
     if sys.hexversion >= 0x03000000:
         stdout = stdout.decode("utf-8") if stdout is not None else stdout
-        stderr = stderr.decode("utf-8") if stderr is not None else stderr
     if retcode:
         print("COMMAND: {0}".format(" ".join(cmd_list)))
-        print("STDOUT:")
+        print("STDOUT/STDERR:")
         print(stdout)
-        print("STDERR:")
+        raise RuntimeError(exmsg)
+    return stdout
+
+
+def shcmd_stream(
+    cmd_list, exmsg, timeout=None, max_lines=1000, callback=None, echo=True
+):
+    """
+    Execute command piping STDERR to STDOUT and streaming its output.
+
+    Output is echoed to the terminal (if echo is True) as it is produced and
+    only its last max_lines lines are kept in memory and returned. The
+    callback function, if any, is called with every output line, an exception
+    it raises is re-raised once the command finishes. A RuntimeError
+    exception is raised if the command fails or if it does not finish within
+    timeout seconds
+    """
+    # pylint: disable=R0913
+    kwargs = {}
+    if (timeout is not None) and (os.name == "posix"):
+        # Command is started in its own process group so that on timeout its
+        # descendants (which may hold the output pipe open) are killed too
+        kwargs["preexec_fn"] = os.setpgrp
+    try:
+        proc = subprocess.Popen(
+            cmd_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs
+        )
+    except:
+        print("COMMAND: {0}".format(" ".join(cmd_list)))
+        raise
+    tail = collections.deque(maxlen=max_lines)
+    errors = []
+    reader = threading.Thread(
+        target=_stream_output, args=(proc.stdout, tail, callback, echo, errors)
+    )
+    reader.daemon = True
+    reader.start()
+    try:
+        reader.join(timeout)
+    except KeyboardInterrupt:
+        # The process group does not receive terminal interrupts
+        _kill_process_tree(proc)
+        raise
+    timed_out = reader.is_alive()
+    if timed_out:
+        _kill_process_tree(proc)
+        # A descendant that left the process group may still hold the pipe
+        # open, its output is not waited for (the reader is a daemon thread)
+        reader.join(_KILL_GRACE_PERIOD)
+    retcode = proc.wait()
+    if errors:
+        raise errors[0]
+    stdout = "".join(tail)
+    if timed_out or retcode:
+        print("COMMAND: {0}".format(" ".join(cmd_list)))
+        print("STDOUT/STDERR (last {0} lines):".format(len(tail)))
         print(stdout)
+        if timed_out:
+            exmsg = "{0} (timed out after {1} seconds)".format(exmsg, timeout)
         raise RuntimeError(exmsg)
     return stdout
+
+
+def write_cache(name, data):
+    """Store data in a persistent cache file, silently ignoring failures."""
+    fname = get_cache_fname(name)
+    if not fname:
+        return
+    try:
+        text = json.dumps(data, sort_keys=True)
+    except (TypeError, ValueError):
+        # Data not serializable, nothing to cache
+        return
+    try:
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        atomic_write(fname, text)
+    except (IOError, OSError):
+        pass
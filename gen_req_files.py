@@ -7,40 +7,65 @@
 # Standard library imports
 from __future__ import print_function
 import os
-import subprocess
+import re
 import sys
 
 # Intra-package imports
-from pypkg.functions import get_supported_interps, json_load
+from pypkg.build_wheel_cache import normalize_name
+from pypkg.functions import get_requirements_model
+
+
+###
+# Global variables
+###
+# Packages bound to the installed version when freezing requirements
+FREEZE_PKGS = ["matplotlib", "numpy", "scipy"]
+REQ_NAME_REGEXP = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)")
 
 
 ###
 # Functions
 ###
-def freeze_pkg_vers(fnames):
+def _installed_versions():
+    """Return versions of installed distributions keyed by normalized name."""
+    try:
+        from importlib import metadata
+
+        dists = [
+            (dist.metadata["Name"], dist.version) for dist in metadata.distributions()
+        ]
+    except ImportError:  # pragma: no cover
+        import pkg_resources
+
+        dists = [
+            (dist.project_name, dist.version) for dist in pkg_resources.working_set
+        ]
+    # Distributions are listed in search path order, the first one found is
+    # the one that is imported
+    ret = {}
+    for name, version in dists:
+        if name:
+            ret.setdefault(normalize_name(name), version)
+    return ret
+
+
+def freeze_pkg_vers(fnames, pkgs=None):
     """Bound version of specific pacakges to what is already installed."""
-    pobj = subprocess.Popen(
-        ["pip", "freeze"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-    )
-    lines, _ = pobj.communicate()
-    if sys.hexversion >= 0x03000000:
-        lines = lines.decode("utf-8")
-    pkgs = {"numpy": "", "scipy": "", "matplotlib": ""}
-    for line in lines.split("\n"):
-        for pkg in pkgs:
-            if line.startswith(pkg):
-                pkgs[pkg] = line
+    pkgs = set(normalize_name(pkg) for pkg in (pkgs or FREEZE_PKGS))
+    versions = _installed_versions()
     for fname in fnames:
-        ilines = read_file(fname)
         olines = []
-        for iline in ilines:
+        for iline in read_file(fname):
             iline = iline.rstrip()
-            for pkg, oline in pkgs.items():
-                if iline.startswith(pkg):
-                    olines.append(oline)
-                    break
-            else:
-                olines.append(iline)
+            match = REQ_NAME_REGEXP.match(iline)
+            name = normalize_name(match.group(1)) if match else None
+            if (name in pkgs) and (name in versions):
+                # Environment markers (i.e. ; python_version < "3") are kept
+                marker = iline.partition(";")[2].strip()
+                iline = "{0}=={1}{2}".format(
+                    match.group(1), versions[name], "; " + marker if marker else ""
+                )
+            olines.append(iline)
         with open(fname, "w") as fobj:
             fobj.write("\n".join(olines))
 
@@ -57,23 +82,17 @@ def insert_element(items, item, pos):
         items[pos] = item
 
 
-def gen_req_files(freeze_ver=False):
+def gen_req_files(freeze_ver=False, freeze_pkgs=None):
     # pylint: disable=R0101,R0912,R0914
     """Generate requirements files."""
-    fdict = json_load(os.path.join("data", "requirements.json"))
-    pyvers = ["py{0}".format(item.replace(".", "")) for item in get_supported_interps()]
+    model = get_requirements_model()
     odict = {"rtd": []}
-    for pyver in pyvers:
+    for pyver in model.pyvers:
         odict["main_{0}".format(pyver)] = []
         odict["tests_{0}".format(pyver)] = []
         odict["docs_{0}".format(pyver)] = []
-    for pkg_name, pkg_dict in fdict.items():
-        pkg_dict["cat"] = (
-            pkg_dict["cat"] if isinstance(pkg_dict["cat"], list) else [pkg_dict["cat"]]
-        )
-        for cat in pkg_dict["cat"]:
-            if cat not in ["main", "tests", "docs", "rtd"]:
-                raise RuntimeError("Category {0} not recognized".format(cat))
+    for pkg_name, pkg_dict in model.pkgs.items():
+        for cat in model.cats[pkg_name]:
             if cat == "rtd":
                 ver = pkg_dict["ver"]
                 if (not isinstance(pkg_dict["ver"], str)) and (
@@ -94,26 +113,12 @@ def gen_req_files(freeze_ver=False):
                     pkg_dict["pos"],
                 )
             else:
-                if not isinstance(pkg_dict["ver"], dict):
-                    for pyver in pyvers:
-                        insert_element(
-                            odict["{cat}_{ver}".format(cat=cat, ver=pyver)],
-                            "{pkg_name}{ver}".format(
-                                pkg_name=pkg_name, ver=pkg_dict["ver"]
-                            ),
-                            pkg_dict["pos"],
-                        )
-                else:
-                    for pyver, pkg_ver in pkg_dict["ver"].items():
-                        if pyver not in pyvers:
-                            raise RuntimeError(
-                                "Python version {0} not recognized".format(pyver)
-                            )
-                        insert_element(
-                            odict["{cat}_{ver}".format(cat=cat, ver=pyver)],
-                            "{pkg_name}{ver}".format(pkg_name=pkg_name, ver=pkg_ver),
-                            pkg_dict["pos"],
-                        )
+                for pyver, pkg_ver in model.matrix[pkg_name].items():
+                    insert_element(
+                        odict["{cat}_{ver}".format(cat=cat, ver=pyver)],
+                        "{pkg_name}{ver}".format(pkg_name=pkg_name, ver=pkg_ver),
+                        pkg_dict["pos"],
+                    )
     pkgdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     reqdir = os.path.join(pkgdir, "requirements")
     fnames = []
@@ -125,7 +130,7 @@ def gen_req_files(freeze_ver=False):
         with open(fname, "w") as fobj:
             fobj.writelines(odict[cat])
     if freeze_ver:
-        freeze_pkg_vers(fnames)
+        freeze_pkg_vers(fnames, freeze_pkgs)
 
 
 def read_file(fname):
@@ -146,4 +151,5 @@ if __name__ == "__main__":
     FREEZE_VER = False
     if (len(sys.argv) > 1) and (sys.argv[1].lower() == "freeze"):
         FREEZE_VER = True
-    gen_req_files(FREEZE_VER)
+    # Packages to freeze can be given after the freeze argument
+    gen_req_files(FREEZE_VER, sys.argv[2:])
@@ -7,9 +7,11 @@
 # Standard library imports
 from __future__ import print_function
 import argparse
-from fnmatch import fnmatch
+from fnmatch import translate
 import glob
+import json
 import os
+import re
 import sys
 
 
@@ -17,11 +19,77 @@ import sys
 # Global variables
 ###
 IS_PY3 = sys.hexversion > 0x03000000
+# File list cache, valid while the exclusion patterns and the modification
+# times of the exclude file and of all walked directories do not change
+CACHE_NAME = "pylint_files.json"
 
 
 ###
 # Functions
 ###
+def _cache_fname(repo_dir):
+    """Return file list cache file name, None if caching is disabled."""
+    # Same location as pypkg.functions.get_cache_fname, not imported because
+    # this script is meant to be run without the package in the search path
+    if os.environ.get("PYPKG_NO_CACHE", ""):
+        return None
+    cache_dir = os.environ.get(
+        "PYPKG_CACHE_DIR", os.path.join(repo_dir, ".pypkg_cache")
+    )
+    return os.path.join(cache_dir, CACHE_NAME)
+
+
+def _compile_patterns(patterns):
+    """Compile glob patterns into file and directory pruning matchers."""
+    # A pattern that ends in "*" excludes every file under a directory whose
+    # path (with a trailing separator) matches the rest of the pattern, so
+    # that directory does not need to be walked. As with fnmatch, patterns
+    # and names are normalized with os.path.normcase and matching is case
+    # insensitive on Windows
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    patterns = [os.path.normcase(item) for item in patterns]
+    fregexp = re.compile(
+        "|".join("(?:{0})".format(translate(item)) for item in patterns), flags
+    )
+    dpatterns = [item[:-1] for item in patterns if item.endswith("*")]
+    dregexp = re.compile(
+        "|".join("(?:{0})".format(translate(item)) for item in dpatterns), flags
+    )
+    return (
+        (lambda name: fregexp.match(os.path.normcase(name)))
+        if patterns
+        else lambda _: None,
+        (lambda name: dregexp.match(os.path.normcase(name)))
+        if dpatterns
+        else lambda _: None,
+    )
+
+
+def _load_cache(fname, key):
+    """Return cached file list if still valid, None otherwise."""
+    if (not fname) or (not os.path.exists(fname)):
+        return None
+    try:
+        with open(fname, "r") as fobj:
+            cache = json.load(fobj)
+        if cache["key"] != key:
+            return None
+        for dname, mtime in cache["dirs"]:
+            if os.stat(dname).st_mtime != mtime:
+                return None
+    except (IOError, OSError, KeyError, TypeError, ValueError):
+        return None
+    return cache["files"]
+
+
+def _mtime(fname):
+    """Return file modification time, None if file does not exist."""
+    try:
+        return os.stat(fname).st_mtime
+    except OSError:
+        return None
+
+
 def _read_file(fname):
     """Return file lines as strings."""
     with open(fname) as fobj:
@@ -29,6 +97,27 @@ def _read_file(fname):
             yield _tostr(line).strip()
 
 
+def _save_cache(fname, key, dirs, files):
+    """Save file list cache, silently ignoring failures."""
+    if not fname:
+        return
+    tmp_fname = "{0}.{1}.tmp".format(fname, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(tmp_fname, "w") as fobj:
+            json.dump({"key": key, "dirs": dirs, "files": files}, fobj)
+        if sys.hexversion >= 0x03030000:
+            os.replace(tmp_fname, fname)
+        else:  # pragma: no cover
+            if os.path.exists(fname):
+                os.remove(fname)
+            os.rename(tmp_fname, fname)
+    except (IOError, OSError):
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+
+
 def _tostr(obj):  # pragma: no cover
     """Convert to string if necessary."""
     return obj if isinstance(obj, str) else (obj.decode() if IS_PY3 else obj.encode())
@@ -49,26 +138,50 @@ def _validate_file(value):
     return value
 
 
-def main(argv):
+def get_pylint_files(repo_dir, source_dir, extra_dir, exclude_fname):
     """Return files for linting."""
-    repo_dir, source_dir, extra_dir, exclude_fname = setup_cli(argv)
     patterns = []
     if os.path.exists(exclude_fname):
         patterns = [
             os.path.abspath(item.format(**os.environ))
             for item in _read_file(exclude_fname)
         ]
+    key = [
+        repo_dir,
+        source_dir,
+        extra_dir,
+        exclude_fname,
+        _mtime(exclude_fname),
+        patterns,
+    ]
+    cache_fname = _cache_fname(repo_dir)
+    ret = _load_cache(cache_fname, key)
+    if ret is not None:
+        return ret
+    fmatch, dmatch = _compile_patterns(patterns)
+    dirs = [[repo_dir, _mtime(repo_dir)]]
     ret = glob.glob(os.path.join(repo_dir, "*.py"))
     for tdir in [source_dir, extra_dir]:
-        for (dirpath, _, fnames) in os.walk(tdir):
+        for (dirpath, dnames, fnames) in os.walk(tdir):
+            dirs.append([dirpath, _mtime(dirpath)])
+            dnames[:] = [
+                item
+                for item in dnames
+                if not dmatch(os.path.join(dirpath, item) + os.sep)
+            ]
             for fname in fnames:
                 _, ext = os.path.splitext(fname)
                 fname = os.path.join(dirpath, fname)
-                if (ext == ".py") and (
-                    not any(fnmatch(fname, pattern) for pattern in patterns)
-                ):
+                if (ext == ".py") and (not fmatch(fname)):
                     ret.append(fname)
-    print(" ".join(sorted(ret)))
+    ret = sorted(ret)
+    _save_cache(cache_fname, key, dirs, ret)
+    return ret
+
+
+def main(argv):
+    """Print files for linting."""
+    print(" ".join(get_pylint_files(*setup_cli(argv))))
 
 
 def setup_cli(argv):
@@ -6,6 +6,61 @@
 import os
 
 
+###
+# Global variables
+###
+# Lines read from included files, keyed by file name. Each entry is a
+# (modification time, lines, complete flag) tuple, files are read only
+# as far as needed so the cached lines may be a prefix of the file
+_FILE_CACHE = {}
+
+
+###
+# Functions
+###
+def _iter_lines(fname, last=None):
+    """Iterate over (line number, line) tuples of a file up to a given line."""
+    mtime = os.path.getmtime(fname)
+    cached_mtime, lines, complete = _FILE_CACHE.get(fname, (None, [], False))
+    if cached_mtime != mtime:
+        lines, complete = [], False
+    if complete or ((last is not None) and (len(lines) >= last)):
+        for num, line in enumerate(lines[:last]):
+            yield num + 1, line
+        return
+    lines = []
+    with open(fname) as fobj:
+        for line in fobj:
+            lines.append(line)
+            yield len(lines), line
+            if (last is not None) and (len(lines) >= last):
+                break
+        else:
+            complete = True
+    _FILE_CACHE[fname] = (mtime, lines, complete)
+
+
+def _parse_lrange(lrange):
+    """Return sorted, merged line intervals; interval end is None for end of file."""
+    intervals = []
+    for token in [item.strip() for item in lrange.split(",")]:
+        if "-" in token:
+            subtokens = token.split("-")
+            intervals.append(
+                (int(subtokens[0]), int(subtokens[1]) if subtokens[1] else None)
+            )
+        else:
+            intervals.append((int(token), int(token)))
+    ret = []
+    for lmin, lmax in sorted(intervals, key=lambda item: item[0]):
+        if ret and ((ret[-1][1] is None) or (lmin <= ret[-1][1] + 1)):
+            if (ret[-1][1] is not None) and ((lmax is None) or (lmax > ret[-1][1])):
+                ret[-1] = (ret[-1][0], lmax)
+        else:
+            ret.append((lmin, lmax))
+    return ret
+
+
 def incfile(fname, fpointer, lrange="1,6-", sdir=None):
     r"""
     Include a Python source file in a docstring formatted in reStructuredText.
@@ -52,33 +107,24 @@ def incfile(fname, fpointer, lrange="1,6-", sdir=None):
             \"\"\"
             return 'This is func output'
     """
-    # Read file
+    # Find file
     file_dir = (
         sdir
         if sdir
         else os.environ.get("TRACER_DIR", os.path.abspath(os.path.dirname(__file__)))
     )
     fname = os.path.join(file_dir, fname)
-    with open(fname) as fobj:
-        lines = fobj.readlines()
     # Parse line specification
-    tokens = [item.strip() for item in lrange.split(",")]
-    inc_lines = []
-    for token in tokens:
-        if "-" in token:
-            subtokens = token.split("-")
-            lmin, lmax = (
-                int(subtokens[0]),
-                int(subtokens[1]) if subtokens[1] else len(lines),
-            )
-            for num in range(lmin, lmax + 1):
-                inc_lines.append(num)
-        else:
-            inc_lines.append(int(token))
+    intervals = _parse_lrange(lrange)
+    last = intervals[-1][1] if intervals else 0
     # Produce output
     fpointer(".. code-block:: python\n")
     fpointer("\n")
-    for num, line in enumerate(lines):
-        if num + 1 in inc_lines:
-            fpointer("    " + line.replace("\t", "    ") if line.strip() else "\n")
+    idx = 0
+    if intervals:
+        for num, line in _iter_lines(fname, last):
+            while (intervals[idx][1] is not None) and (num > intervals[idx][1]):
+                idx += 1
+            if num >= intervals[idx][0]:
+                fpointer("    " + line.replace("\t", "    ") if line.strip() else "\n")
     fpointer("\n")
@@ -0,0 +1,120 @@
+#!/bin/bash
+# make-vars.sh
+# Copyright (c) 2013-2020 Pablo Acosta-Serafini
+# See LICENSE for details
+
+# Print the value of a Makefile variable that is expensive to compute. Values
+# are cached in the package cache directory (PYPKG_CACHE_DIR, disabled by
+# PYPKG_NO_CACHE) and re-computed only when their inputs change. Usage:
+#   make-vars.sh num_cpus
+#   make-vars.sh pylint_plugins_list <pylint plugins directory>
+#   make-vars.sh lint_files <package name> <repo dir> <source dir> <extra dir>
+
+sdir=$(dirname "${BASH_SOURCE[0]}")
+# shellcheck disable=SC1090,SC1091,SC2024
+source "${sdir}/functions.sh"
+### Unofficial strict mode
+set -euo pipefail
+IFS=$'\n\t'
+#
+# Cache key of a list of directories, changes when a file or sub-directory
+# is added, removed or renamed in any of them
+dirs_key() {
+    local dname
+    for dname in "$@"; do
+        if [ -d "${dname}" ]; then
+            find "${dname}" -type d -printf '%p %T@\n'
+        fi
+    done | md5sum | cut -d " " -f 1
+}
+# Cache key of the directories listed in a file, one per line. Only the
+# directories themselves are stat-ed (they are not walked), a directory
+# that no longer exists is left out and thus changes the key too
+listed_dirs_key() {
+    if [ -f "$1" ]; then
+        # shellcheck disable=SC2016
+        xargs -d '\n' -r -a "$1" \
+            sh -c 'find "$@" -maxdepth 0 -printf "%p %T@\n"' sh 2> /dev/null || true
+    fi | md5sum | cut -d " " -f 1
+}
+num_cpus() {
+    python -c "from __future__ import print_function; import multiprocessing; print(multiprocessing.cpu_count())"
+}
+pylint_plugins_list() {
+    local plugins_dir="$1" fname ret=()
+    if [ "${plugins_dir}" != "" ]; then
+        for fname in "${plugins_dir}"/*.py; do
+            fname="$(basename "${fname}" .py)"
+            if [ "${fname}" != "*" ] && [[ "${fname}" != common* ]]; then
+                ret+=("${fname}")
+            fi
+        done
+    fi
+    local IFS=","
+    echo "${ret[*]}"
+}
+lint_files() {
+    "${sdir}/get-pylint-files.sh" "$@"
+}
+#
+var=$1
+shift
+case "${var}" in
+    num_cpus|pylint_plugins_list|lint_files)
+        ;;
+    *)
+        echo "make-vars.sh: unknown variable ${var}" >&2
+        exit 1
+        ;;
+esac
+if [ "${PYPKG_NO_CACHE:-}" != "" ]; then
+    "${var}" "$@"
+    exit 0
+fi
+pkg_dir=$(readlink -f "${sdir}/..")
+cache_dir="${PYPKG_CACHE_DIR:-${pkg_dir}/.pypkg_cache}"
+cache_fname="${cache_dir}/make_${var}"
+# The lint file list depends on the names of the files in the package, tests
+# and docs directory trees. Walking them (as get-pylint-files.sh does) to
+# build the key would save nothing, so the key is built from the directories
+# found the last time the list was produced (a new sub-directory changes the
+# modification time of its parent)
+dirs_fname="${cache_fname}.dirs"
+case "${var}" in
+    num_cpus)
+        key="$(uname -n)"
+        ;;
+    pylint_plugins_list)
+        key="$(echo "$@")"
+        if [ "${1:-}" != "" ]; then
+            key="${key} $(dirs_key "$1")"
+        fi
+        ;;
+    lint_files)
+        key="$(echo "$@") $(listed_dirs_key "${dirs_fname}")"
+        ;;
+esac
+if [ -f "${cache_fname}" ] && [ "$(head -n 1 "${cache_fname}")" == "${key}" ]; then
+    tail -n +2 "${cache_fname}"
+    exit 0
+fi
+mkdir -p "${cache_dir}"
+if [ "${var}" == "lint_files" ]; then
+    # Key is taken before the list is produced, so that changes made while
+    # it is produced invalidate it
+    repo_dir=$(readlink -f "$2")
+    # Repository directory is listed (not walked) so that creating the tests
+    # or docs directories invalidates the list too
+    echo "${repo_dir}" > "${dirs_fname}"
+    for dname in "${repo_dir}/$1" "${repo_dir}/tests" "${repo_dir}/docs"; do
+        if [ -d "${dname}" ]; then
+            find "${dname}" -type d
+        fi
+    done >> "${dirs_fname}"
+    key="$(echo "$@") $(listed_dirs_key "${dirs_fname}")"
+fi
+value="$("${var}" "$@")"
+tmp_fname="${cache_fname}.$$.tmp"
+printf '%s\n%s\n' "${key}" "${value}" > "${tmp_fname}"
+mv -f "${tmp_fname}" "${cache_fname}"
+echo "${value}"
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# make_wheels.py
+# Copyright (c) 2013-2020 Pablo Acosta-Serafini
+# See LICENSE for details
+# pylint: disable=C0111,C0413,E0401
+
+# Standard library imports
+from __future__ import print_function
+import argparse
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Intra-package imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import pypkg.functions
+
+
+###
+# Global variables
+###
+# Files and directories not needed to build a wheel (at any depth)
+STAGING_EXCLUDE = [".git", ".pypkg_cache", ".tox", "__pycache__", "*.egg-info", "*.pyc"]
+# Build output directories, excluded only from the package directory itself
+# since sub-packages or data directories may have the same name
+STAGING_TOP_EXCLUDE = ["build", "dist"]
+
+
+###
+# Functions
+###
+def _build_wheel(pars):
+    """Build wheel for a single Python interpreter version."""
+    # Each interpreter version is built in its own copy of the package so
+    # that builds do not share setup.py, MANIFEST.in or the build directory
+    pkg_dir, staging_dir, dist_dir, pyver = pars
+    pytag = "py{0}".format(pyver.replace(".", ""))
+    stage_dir = os.path.join(staging_dir, pytag)
+    shutil.copytree(
+        pkg_dir, stage_dir, symlinks=True, ignore=_staging_ignore(pkg_dir),
+    )
+    stage_setup = os.path.join(stage_dir, "setup.py")
+    with open(os.path.realpath(os.path.join(pkg_dir, "setup.py")), "r") as fobj:
+        text = fobj.read()
+    # setup.py may be a symbolic link, replace it with a modified copy
+    os.remove(stage_setup)
+    with open(stage_setup, "w") as fobj:
+        fobj.write(text.replace("data_files=DATA_FILES,", "data_files=None,"))
+    pypkg.functions.gen_manifest(make_wheel=True, pkg_dir=stage_dir)
+    pycmd = os.path.join(
+        os.environ["HOME"],
+        "python",
+        "python{0}".format(pyver),
+        "bin",
+        "python{0}".format(pyver),
+    )
+    if not os.path.exists(pycmd):
+        return 1, "Python {0} interpreter not found".format(pyver)
+    proc = subprocess.Popen(
+        [
+            pycmd,
+            "setup.py",
+            "bdist_wheel",
+            "--python-tag",
+            pytag,
+            "--dist-dir",
+            dist_dir,
+        ],
+        cwd=stage_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    stdout, _ = proc.communicate()
+    if sys.hexversion >= 0x03000000:
+        stdout = stdout.decode("utf-8")
+    return proc.returncode, stdout
+
+
+def _staging_ignore(pkg_dir):
+    """Return shutil.copytree ignore function for the staging copy."""
+    patterns = shutil.ignore_patterns(*STAGING_EXCLUDE)
+
+    def ignore(dname, fnames):
+        ret = set(patterns(dname, fnames))
+        if os.path.abspath(dname) == os.path.abspath(pkg_dir):
+            ret.update(
+                fname
+                for fname in STAGING_TOP_EXCLUDE
+                if (fname in fnames) and os.path.isdir(os.path.join(dname, fname))
+            )
+        return ret
+
+    return ignore
+
+
+def make_wheels(pyvers=None, num_jobs=None):
+    """Build wheels for all supported Python interpreter versions concurrently."""
+    pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    dist_dir = os.path.join(pkg_dir, "dist")
+    pyvers = pyvers or pypkg.functions.get_supported_interps()
+    if not os.path.isdir(dist_dir):
+        os.makedirs(dist_dir)
+    staging_dir = tempfile.mkdtemp(prefix="make_wheels_")
+    retcode = 0
+    try:
+        pool = ThreadPool(min(num_jobs or len(pyvers), len(pyvers)))
+        try:
+            results = pool.map(
+                _build_wheel,
+                [(pkg_dir, staging_dir, dist_dir, pyver) for pyver in pyvers],
+            )
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    # Results are reported in interpreter version order
+    for pyver, (pretcode, stdout) in zip(pyvers, results):
+        print(
+            pypkg.functions.pcolor(
+                "Building Python {0} wheel".format(pyver), "red" if pretcode else "cyan"
+            )
+        )
+        if pretcode:
+            print(stdout)
+        retcode = pretcode if not retcode else retcode
+    return retcode
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(
+        description="Build package wheels for supported Python interpreters"
+    )
+    PARSER.add_argument(
+        "pyvers",
+        help="Python interpreter versions (default: all supported versions)",
+        nargs="*",
+    )
+    PARSER.add_argument(
+        "-j",
+        "--jobs",
+        help="number of wheels built concurrently (default: all)",
+        type=int,
+        default=None,
+    )
+    ARGS = PARSER.parse_args()
+    sys.exit(make_wheels(ARGS.pyvers, ARGS.jobs))
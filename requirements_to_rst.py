@@ -4,10 +4,9 @@
 # See LICENSE for details
 # pylint: disable=C0103,C0111,R0912,R0914,R0915,R1717,R1718
 
-import os
 import textwrap
 
-from pypkg.functions import get_supported_interps, json_load
+from pypkg.functions import get_requirements_model
 
 
 ###
@@ -21,7 +20,7 @@ LINE_WIDTH = 72
 ###
 def def_links(mobj):
     """Define Sphinx requirements links."""
-    fdict = json_load(os.path.join("data", "requirements.json"))
+    fdict = get_requirements_model().pkgs
     sdeps = sorted(fdict.keys())
     olines = []
     for item in sdeps:
@@ -104,14 +103,14 @@ def ops_to_words(item):
 
 def proc_requirements(mobj):
     """Get requirements in reStructuredText format."""
-    pyvers = ["py{0}".format(item.replace(".", "")) for item in get_supported_interps()]
+    model = get_requirements_model()
+    pyvers = model.pyvers
     py2vers = sorted([item for item in pyvers if item.startswith("py2")])
     py3vers = sorted([item for item in pyvers if item.startswith("py3")])
-    fdict = json_load(os.path.join("data", "requirements.json"))
     olines = [""]
-    sdict = dict([(item["name"], item) for item in fdict.values()])
+    sdict = dict([(item["name"], item) for item in model.pkgs.values()])
     for real_name in sorted(sdict.keys()):
-        pkg_dict = sdict[real_name]
+        pkg_dict = dict(sdict[real_name])
         if pkg_dict["cat"] == ["rtd"]:
             continue
         plist = [] if not pkg_dict["optional"] else ["optional"]
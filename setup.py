@@ -1,7 +1,7 @@
 # setup.py
 # Copyright (c) 2013-2020 Pablo Acosta-Serafini
 # See LICENSE for details
-# pylint: disable=C0111,E0401,E0601,E1111,R0904,W0122,W0201,W0621
+# pylint: disable=C0111,C0413,E0401,E0601,E1111,R0904,W0122,W0201,W0621
 
 # Taken in large part from:
 #    http://www.jeffknupp.com/blog/2013/08/16/
@@ -24,6 +24,7 @@ from setuptools.command.test import test as TestCommand
 
 # Intra-package imports
 from pypkg.functions import (
+    find_pkgdata,
     get_entry_points,
     get_pkg_data_files,
     get_pkg_submodules,
@@ -37,27 +38,13 @@ from pypkg.functions import (
 # When installing from tarball/zip/wheel, path is temporary one and setup.py
 # is not in a directory where its name is the package name, have to find
 # package name by finding location of pkgdata file
-STEM = "pkgdata"
-FOUND = False
-START_DIR = os.path.dirname(os.path.abspath(__file__))
-for (DIRPATH, _, FNAMES) in os.walk(START_DIR):
-    # Ignore .tox, .git and other directories
-    if DIRPATH[len(START_DIR) + 1 :].startswith("."):
-        continue
-    #
-    for FNAME in FNAMES:
-        if os.path.splitext(os.path.basename(FNAME))[0] == STEM:
-            FNAME = os.path.join(DIRPATH, FNAME)
-            sys.path.append(DIRPATH)
-            import pkgdata
-
-            PKG_NAME = os.path.basename(
-                os.path.dirname(os.path.abspath(sys.modules["pkgdata"].__file__))
-            )
-            FOUND = True
-            break
-if not FOUND:
+PKGDATA_DIR = find_pkgdata(os.path.dirname(os.path.abspath(__file__)))
+if not PKGDATA_DIR:
     raise RuntimeError("Supported Python interpreter versions cold not be found")
+sys.path.append(PKGDATA_DIR)
+import pkgdata
+
+PKG_NAME = os.path.basename(PKGDATA_DIR)
 PYTHON_VER = python_version("{0:0x}".format(sys.hexversion & 0xFFFF0000)[:-4])
 SUPPORTED_INTERPS = sorted(pkgdata.SUPPORTED_INTERPS)
 if PYTHON_VER not in SUPPORTED_INTERPS:
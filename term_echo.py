@@ -3,15 +3,235 @@
 # See LICENSE for details
 # pylint: disable=C0111,R0912,R1717
 
+import contextlib
+import functools
+import hashlib
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 import platform
 import subprocess
 import sys
 
+import pypkg.functions
+
+
+###
+# Global variables
+###
+# Command output cache, keyed by command, environment variable replacements,
+# number of columns and contents of the invoked script. It is persisted
+# (unless the PYPKG_NO_CACHE environment variable is set) so that
+# documentation builds do not re-run commands whose output cannot change
+CACHE_NAME = "term_echo.json"
+# Commands echoed by each documentation file the last time it was processed,
+# used to run them concurrently ahead of the next processing
+SPECS_CACHE_NAME = "term_echo_specs.json"
+_CACHE = {}
+_CACHE_LOADED = False
+# Original term_echo-like functions replaced by hook_module, keyed by the
+# name of the module they are defined in
+_HOOKED = {}
+# Commands echoed while recording (see recording), None when not recording
+_RECORDED = {"specs": None}
+
 
 ###
 # Functions
 ###
+def _cache_key(command, env, cols, renderer=None):
+    """Return cache key of a command."""
+    # The invoked script is the first token that is an existing file, i.e.
+    # the second one if the command is run through the Python interpreter
+    script = next(
+        (token for token in _command_tokens(command, env) if os.path.isfile(token)),
+        None,
+    )
+    digest = None
+    if script:
+        with open(script, "rb") as fobj:
+            digest = hashlib.sha1(fobj.read()).hexdigest()
+    key = json.dumps([command, sorted((env or {}).items()), cols, digest, renderer])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _capture(func, command, nindent, env, cols):
+    """Return output function calls made by a term_echo-like function."""
+    calls = []
+    func(
+        command,
+        nindent,
+        env,
+        lambda *args, **kwargs: calls.append([list(args), kwargs]),
+        cols,
+    )
+    return calls
+
+
+def _command_tokens(command, env):
+    """Return command tokens after environment variable replacement."""
+    command_int = command
+    if env:
+        for var, repl in env.items():
+            command_int = command_int.replace('"${' + var + '}"', repl)
+            command_int = command_int.replace("${" + var + "}", repl)
+    tokens = command_int.split(" ")
+    # Add Python interpreter executable for Python scripts on Windows since
+    # the shebang does not work
+    if (platform.system().lower() == "windows") and (tokens[0].endswith(".py")):
+        tokens = [sys.executable] + tokens
+    return tokens
+
+
+def _hooked_term_echo(func, renderer):
+    """Return cached version of a term_echo-like function."""
+
+    @functools.wraps(func)
+    def term_echo(command, nindent=0, env=None, fpointer=None, cols=60):
+        if _RECORDED["specs"] is not None:
+            _RECORDED["specs"].append([command, env, cols, [renderer, nindent]])
+        _load_cache()
+        key = _cache_key(command, env, cols, [renderer, nindent])
+        if key not in _CACHE:
+            _CACHE[key] = _capture(func, command, nindent, env, cols)
+            _save_cache()
+        for args, kwargs in _CACHE[key]:
+            fpointer(*args, **kwargs)
+
+    term_echo.hooked = True
+    return term_echo
+
+
+def _load_cache():
+    """Load persistent cache (once per process)."""
+    global _CACHE_LOADED  # pylint: disable=W0603
+    if _CACHE_LOADED:
+        return
+    _CACHE_LOADED = True
+    _CACHE.update(pypkg.functions.read_cache(CACHE_NAME) or {})
+
+
+def _run_command(command, env, cols):
+    """Return STDOUT resulting from a Bash shell command."""
+    # Set argparse width so that output does not need horizontal scroll
+    # bar in narrow windows or displays
+    penv = dict(os.environ)
+    penv["COLUMNS"] = str(cols)
+    proc = subprocess.Popen(
+        _command_tokens(command, env),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=penv,
+    )
+    stdout = proc.communicate()[0]
+    if sys.hexversion >= 0x03000000:
+        stdout = stdout.decode("utf-8")
+    return stdout
+
+
+def _run_spec(command, env, cols, hook):
+    """Return output of a command, captured output if run by a hooked function."""
+    if hook is None:
+        return _run_command(command, env, cols)
+    renderer, nindent = hook
+    return _capture(_HOOKED[renderer], command, nindent, env, cols)
+
+
+def _save_cache():
+    """Save persistent cache, merging entries saved by other processes."""
+    cache = pypkg.functions.read_cache(CACHE_NAME) or {}
+    cache.update(_CACHE)
+    pypkg.functions.write_cache(CACHE_NAME, cache)
+
+
+def _ste_command(command):
+    """Return command relative to the package pypkg directory."""
+    return "${{PMISC_DIR}}{sep}pypkg{sep}{cmd}".format(sep=os.path.sep, cmd=command)
+
+
+def clear_cache():
+    """Discard cached command output, both in memory and persisted."""
+    global _CACHE_LOADED  # pylint: disable=W0603
+    _CACHE.clear()
+    _CACHE_LOADED = True
+    pypkg.functions.write_cache(CACHE_NAME, {})
+
+
+def get_output(command, env=None, cols=60):
+    """Return (possibly cached) STDOUT resulting from a Bash shell command."""
+    if _RECORDED["specs"] is not None:
+        _RECORDED["specs"].append([command, env, cols])
+    _load_cache()
+    key = _cache_key(command, env, cols)
+    if key not in _CACHE:
+        _CACHE[key] = _run_command(command, env, cols)
+        _save_cache()
+    return _CACHE[key]
+
+
+def hook_module(mobj):
+    """
+    Cache output of the term_echo function of a module.
+
+    The function is replaced in place, both in the module and in the module
+    where it is defined (so that functions implemented with it, i.e. ste,
+    use the replacement too), by a version that caches its output. This lets
+    documentation that uses another term_echo implementation (i.e. pmisc)
+    benefit from :py:func:`recording` and :py:func:`term_echo_batch`. The
+    function has to have the same signature as :py:func:`term_echo`
+
+    :param mobj: Module
+    :type  mobj: module object
+    """
+    func = mobj.term_echo
+    if getattr(func, "hooked", False):
+        return
+    _HOOKED[func.__module__] = func
+    hooked = _hooked_term_echo(func, func.__module__)
+    mobj.term_echo = hooked
+    setattr(sys.modules[func.__module__], "term_echo", hooked)
+
+
+def load_specs(names):
+    """
+    Return commands recorded for a list of names with :py:func:`save_specs`.
+
+    The commands can be run concurrently with :py:func:`term_echo_batch`
+    """
+    specs = pypkg.functions.read_cache(SPECS_CACHE_NAME) or {}
+    return [spec for name in names for spec in specs.get(name, [])]
+
+
+@contextlib.contextmanager
+def recording():
+    """
+    Record echoed commands.
+
+    Yields the list of commands echoed (and run, or retrieved from the cache)
+    while recording, which can be saved with :py:func:`save_specs`
+    """
+    specs = []
+    _RECORDED["specs"] = specs
+    try:
+        yield specs
+    finally:
+        _RECORDED["specs"] = None
+
+
+def save_specs(specs):
+    """
+    Save recorded commands.
+
+    :param specs: Commands recorded by :py:func:`recording`, keyed by name
+                  (i.e. the documentation file they were echoed in)
+    :type  specs: dictionary
+    """
+    cache = pypkg.functions.read_cache(SPECS_CACHE_NAME) or {}
+    cache.update(specs)
+    pypkg.functions.write_cache(SPECS_CACHE_NAME, cache)
+
+
 def ste(command, nindent, mdir, fpointer):
     r"""
     Echo terminal output.
@@ -57,11 +277,19 @@ def ste(command, nindent, mdir, fpointer):
         .. ]]]
 
     """
-    term_echo(
-        "${{PMISC_DIR}}{sep}pypkg{sep}{cmd}".format(sep=os.path.sep, cmd=command),
-        nindent,
-        {"PMISC_DIR": mdir},
-        fpointer,
+    term_echo(_ste_command(command), nindent, {"PMISC_DIR": mdir}, fpointer)
+
+
+def ste_batch(commands, mdir, num_workers=None):
+    """
+    Run commands relative to the package pypkg directory concurrently.
+
+    Output is cached, subsequent :py:func:`ste` calls with the same arguments
+    do not run the commands again
+    """
+    term_echo_batch(
+        [(_ste_command(command), {"PMISC_DIR": mdir}) for command in commands],
+        num_workers,
     )
 
 
@@ -93,24 +321,10 @@ def term_echo(command, nindent=0, env=None, fpointer=None, cols=60):
     :param cols: Number of columns of output
     :type  cols: integer
     """
-    # pylint: disable=R0204
     # Set argparse width so that output does not need horizontal scroll
     # bar in narrow windows or displays
     os.environ["COLUMNS"] = str(cols)
-    command_int = command
-    if env:
-        for var, repl in env.items():
-            command_int = command_int.replace("${" + var + "}", repl)
-    tokens = command_int.split(" ")
-    # Add Python interpreter executable for Python scripts on Windows since
-    # the shebang does not work
-    if (platform.system().lower() == "windows") and (tokens[0].endswith(".py")):
-        tokens = [sys.executable] + tokens
-    proc = subprocess.Popen(tokens, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout = proc.communicate()[0]
-    if sys.hexversion >= 0x03000000:
-        stdout = stdout.decode("utf-8")
-    stdout = stdout.split("\n")
+    stdout = get_output(command, env, cols).split("\n")
     indent = nindent * " "
     fpointer("\n", dedent=False)
     fpointer("{0}.. code-block:: bash\n".format(indent), dedent=False)
@@ -122,3 +336,45 @@ def term_echo(command, nindent=0, env=None, fpointer=None, cols=60):
         else:
             fpointer("\n", dedent=False)
     fpointer("\n", dedent=False)
+
+
+def term_echo_batch(specs, num_workers=None):
+    """
+    Run Bash shell commands concurrently and cache their output.
+
+    :param specs: Commands to run, each one a (command, env) or a
+                  (command, env, cols) tuple with the same meaning as the
+                  homonymous :py:func:`term_echo` arguments, or a command
+                  recorded by :py:func:`recording`. Commands recorded from a
+                  term_echo function not hooked in this process are ignored
+    :type  specs: list of tuples
+
+    :param num_workers: Maximum number of commands run at the same time,
+                        defaults to the number of CPUs
+    :type  num_workers: integer
+    """
+    _load_cache()
+    pending = {}
+    for spec in specs:
+        command, env = spec[:2]
+        cols = spec[2] if len(spec) > 2 else 60
+        hook = list(spec[3]) if len(spec) > 3 else None
+        if (hook is not None) and (hook[0] not in _HOOKED):
+            continue
+        key = _cache_key(command, env, cols, hook)
+        if key not in _CACHE:
+            pending[key] = (command, env, cols, hook)
+    if not pending:
+        return
+    # Hooked implementations set the COLUMNS environment variable themselves,
+    # commands with a different number of columns are not run at the same time
+    for cols in sorted(set(spec[2] for spec in pending.values())):
+        keys = sorted(key for key, spec in pending.items() if spec[2] == cols)
+        pool = ThreadPool(min(num_workers or multiprocessing.cpu_count(), len(keys)))
+        try:
+            outputs = pool.map(lambda key: _run_spec(*pending[key]), keys)
+        finally:
+            pool.close()
+            pool.join()
+        _CACHE.update(zip(keys, outputs))
+    _save_cache()
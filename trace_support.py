@@ -5,12 +5,23 @@
 
 # Standard library imports
 from __future__ import print_function
+import ast
 import collections
 import copy
 import datetime
+import hashlib
+import itertools
+import json
 import os
+import pickle
+import sys
 import warnings
 
+if sys.hexversion < 0x03000000:  # pragma: no cover
+    import imp
+else:
+    import importlib.machinery
+
 # PyPI imports
 with warnings.catch_warnings():
     from _pytest.warning_types import PytestWarning
@@ -24,6 +35,156 @@ import pexdoc.exdoc
 ###
 # Functions
 ###
+def _load_pickle(fname):
+    """Load pickled tracing output, None if it cannot be read."""
+    try:
+        with open(fname, "rb") as fobj:
+            return pickle.load(fobj)
+    except Exception:  # pylint: disable=W0703
+        return None
+
+
+def _find_module(name, path):
+    """Return file name and package search path of a module, without importing it."""
+    if sys.hexversion >= 0x03040000:
+        spec = importlib.machinery.PathFinder.find_spec(name, path)
+        if spec is None:
+            return None, None
+        return spec.origin, spec.submodule_search_locations
+    try:  # pragma: no cover
+        fobj, fname, desc = imp.find_module(name.rpartition(".")[2], path)
+    except ImportError:  # pragma: no cover
+        return None, None
+    if fobj:  # pragma: no cover
+        fobj.close()
+    if desc[2] == imp.PKG_DIRECTORY:  # pragma: no cover
+        return os.path.join(fname, "__init__.py"), [fname]
+    return fname, None  # pragma: no cover
+
+
+def _module_deps(fnames, search_dirs):
+    """Return modules imported (directly or not) by a list of modules."""
+    # Imports are found by parsing the modules, only modules in the search
+    # directories (i.e. not installed packages) are followed
+    ret = set()
+    pending = list(fnames)
+    while pending:
+        fname = os.path.realpath(pending.pop())
+        if (fname in ret) or (not os.path.isfile(fname)):
+            continue
+        ret.add(fname)
+        # Package of the module, relative imports are resolved against it
+        dname = os.path.dirname(fname)
+        mtokens = []
+        if os.path.isfile(os.path.join(dname, "__init__.py")):
+            mtokens = os.path.relpath(
+                dname, os.path.dirname(_package_dir(fname))
+            ).split(os.sep)
+        with open(fname, "rb") as fobj:
+            try:
+                tree = ast.parse(fobj.read(), fname)
+            except SyntaxError:
+                continue
+        names = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                if node.level and (not mtokens):
+                    continue
+                if node.level:
+                    # Relative import, level 1 is the package of the module
+                    base = ".".join(
+                        mtokens[: len(mtokens) - node.level + 1]
+                        + ([node.module] if node.module else [])
+                    )
+                else:
+                    base = node.module or ""
+                names.append(base)
+                names.extend(base + "." + alias.name for alias in node.names)
+        for name, sdir in itertools.product(names, search_dirs):
+            tokens = name.split(".")
+            # Parent packages are run when a module is imported
+            for num in range(1, len(tokens) + 1):
+                mfname = os.path.join(sdir, *tokens[:num])
+                pending.extend([os.path.join(mfname, "__init__.py"), mfname + ".py"])
+    return sorted(ret)
+
+
+def _module_fname(module_prefix):
+    """Return source file name of the module a callable prefix belongs to."""
+    # Prefix may include class names, e.g. pkg.module.Class. The module is
+    # not imported, import-time code has to run within the trace
+    tokens = module_prefix.rstrip(".").split(".")
+    fname, path = None, None
+    for num in range(1, len(tokens) + 1):
+        tfname, path = _find_module(".".join(tokens[:num]), path)
+        if not tfname:
+            break
+        fname = tfname
+        if path is None:
+            # Module found, remaining tokens are class names
+            break
+    return os.path.splitext(fname)[0] + ".py" if fname else None
+
+
+def _package_dir(fname):
+    """Return top-level package directory of a module."""
+    ret = dname = os.path.dirname(fname)
+    while os.path.isfile(os.path.join(dname, "__init__.py")):
+        ret = dname
+        dname = os.path.dirname(dname)
+    return ret
+
+
+def _read_index(fname):
+    """Read trace index file, None if it cannot be read."""
+    try:
+        with open(fname, "r") as fobj:
+            return json.load(fobj)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _trace_module(mname, fname, par, module_exclude, no_print, debug):
+    """Trace module exceptions by running its tests."""
+    # pylint: disable=R0913
+    with pexdoc.exdoc.ExDocCxt(
+        exclude=par.exclude + module_exclude,
+        pickle_fname=par.pickle_fname,
+        in_callables_fname=par.in_callables_fname,
+        out_callables_fname=par.out_callables_fname,
+        _no_print=no_print,
+    ) as exdoc_obj:
+        test_cmd = (
+            ["--color=yes"]
+            + (["-s", "-vv"] if debug else ["-q", "-q", "-q"])
+            + ["--disable-warnings"]
+            + ["-x"]
+            + ([par.noption] if par.noption else [])
+            + ["-m " + mname]
+            + [fname]
+        )
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=PytestWarning)
+            if pytest.main(test_cmd):
+                raise RuntimeError("Tracing did not complete successfully")
+    return exdoc_obj
+
+
+def trace_digest(fnames, exclude):
+    """Return digest of the contents of the files that a module trace depends on."""
+    hobj = hashlib.sha1(json.dumps(sorted(exclude)).encode("utf-8"))
+    for fname in fnames:
+        if (fname is None) or (not os.path.isfile(fname)):
+            # Inputs cannot be determined, trace cannot be reused
+            return None
+        hobj.update(fname.encode("utf-8"))
+        with open(fname, "rb") as fobj:
+            hobj.update(fobj.read())
+    return hobj.hexdigest()
+
+
 def trace_pars(mname):
     """Define trace parameters."""
     pickle_fname = os.path.join(os.path.dirname(__file__), "{0}.pkl".format(mname))
@@ -31,6 +192,9 @@ def trace_pars(mname):
     moddb_fname = os.path.join(ddir, "moddb.json")
     in_callables_fname = moddb_fname if os.path.exists(moddb_fname) else None
     out_callables_fname = os.path.join(ddir, "{0}.json".format(mname))
+    index_fname = os.path.join(
+        os.path.dirname(__file__), "{0}.trace.json".format(mname)
+    )
     noption = os.environ.get("NOPTION", None)
     exclude = ["_pytest", "execnet"]
     partuple = collections.namedtuple(
@@ -41,10 +205,16 @@ def trace_pars(mname):
             "out_callables_fname",
             "noption",
             "exclude",
+            "index_fname",
         ],
     )
     return partuple(
-        pickle_fname, in_callables_fname, out_callables_fname, noption, exclude
+        pickle_fname,
+        in_callables_fname,
+        out_callables_fname,
+        noption,
+        exclude,
+        index_fname,
     )
 
 
@@ -64,35 +234,45 @@ def run_trace(
     callable_exclude = [] if callable_exclude is None else callable_exclude
     par = trace_pars(mname)
     start_time = datetime.datetime.now()
-    with pexdoc.exdoc.ExDocCxt(
-        exclude=par.exclude + module_exclude,
-        pickle_fname=par.pickle_fname,
-        in_callables_fname=par.in_callables_fname,
-        out_callables_fname=par.out_callables_fname,
-        _no_print=no_print,
-    ) as exdoc_obj:
-        fname = os.path.realpath(
-            os.path.join(
-                os.path.dirname(__file__),
-                "..",
-                "..",
-                "tests",
-                "test_{0}.py".format(fname),
-            )
+    fname = os.path.realpath(
+        os.path.join(
+            os.path.dirname(__file__), "..", "..", "tests", "test_{0}.py".format(fname)
         )
-        test_cmd = (
-            ["--color=yes"]
-            + (["-s", "-vv"] if debug else ["-q", "-q", "-q"])
-            + ["--disable-warnings"]
-            + ["-x"]
-            + ([par.noption] if par.noption else [])
-            + ["-m " + mname]
-            + [fname]
+    )
+    # Trace output is reused if neither the module, its tests, the pytest
+    # configuration files, the package and test support modules they import
+    # nor the callables database changed since the module was last traced
+    mfname = _module_fname(module_prefix)
+    tests_dir = os.path.dirname(fname)
+    conftest_fnames = [
+        os.path.join(dname, "conftest.py")
+        for dname in [tests_dir, os.path.dirname(tests_dir)]
+    ]
+    digest = trace_digest(
+        (
+            _module_deps(
+                [mfname, fname] + conftest_fnames,
+                [os.path.dirname(_package_dir(mfname)), tests_dir],
+            )
+            if mfname
+            else [None]
         )
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=PytestWarning)
-            if pytest.main(test_cmd):
-                raise RuntimeError("Tracing did not complete successfully")
+        + ([par.in_callables_fname] if par.in_callables_fname else []),
+        par.exclude + module_exclude,
+    )
+    index = _read_index(par.index_fname) or {}
+    pickle_dict = (
+        _load_pickle(par.pickle_fname)
+        if digest and (index.get("digest", None) == digest)
+        else None
+    )
+    if pickle_dict and os.path.exists(par.out_callables_fname):
+        exdoc_obj = pickle_dict["exdoc"]
+    else:
+        exdoc_obj = _trace_module(mname, fname, par, module_exclude, no_print, debug)
+        if digest:
+            with open(par.index_fname, "w") as fobj:
+                json.dump({"digest": digest}, fobj)
     stop_time = datetime.datetime.now()
     if not no_print:
         print(
@@ -6,7 +6,10 @@
 
 # Standard library imports
 from __future__ import print_function
+import argparse
 import datetime
+from multiprocessing.pool import ThreadPool
+import mmap
 import os
 import re
 
@@ -14,9 +17,65 @@ import re
 import pypkg.functions
 
 
+###
+# Global variables
+###
+# Copyright notice is only looked for in the first HEADER_SIZE bytes of a file
+HEADER_SIZE = 4096
+# Persistent index of files that do not need updating, keyed by file name
+# relative to package directory, value is modification time and size
+INDEX_NAME = "copyright_index.json"
+NOTICE_REGEXP = re.compile(
+    b"Copyright \\(c\\) 2013-(\\d\\d\\d\\d) Pablo Acosta-Serafini"
+)
+NOTICE_TEXT_REGEXP = re.compile(
+    "Copyright \\(c\\) 2013-\\d\\d\\d\\d Pablo Acosta-Serafini"
+)
+NOTICE_TEMPLATE = "Copyright (c) 2013-{0} Pablo Acosta-Serafini"
+
+
 ###
 # Functions
 ###
+def _file_sig(fname):
+    """Return file signature (modification time and size)."""
+    fstat = os.stat(fname)
+    return [fstat.st_mtime, fstat.st_size]
+
+
+def _update_file(pars):
+    """Update copyright notice of a file, return True if file changed."""
+    fname, year = pars
+    if not needs_update(fname, year):
+        return False
+    text = "".join(read_file(fname))
+    pypkg.functions.atomic_write(
+        fname, NOTICE_TEXT_REGEXP.sub(NOTICE_TEMPLATE.format(year), text)
+    )
+    return True
+
+
+def needs_update(fname, year):
+    """Check whether the header of a file has an outdated copyright notice."""
+    # Files are memory-mapped so that only the header is read from disk,
+    # binary files (NUL bytes in header) are skipped
+    with open(fname, "rb") as fobj:
+        size = os.fstat(fobj.fileno()).st_size
+        if not size:
+            return False
+        length = min(size, HEADER_SIZE)
+        mobj = mmap.mmap(fobj.fileno(), length, access=mmap.ACCESS_READ)
+        try:
+            if mobj.find(b"\0", 0, length) != -1:
+                return False
+            return any(
+                int(rmatch.group(1)) != year
+                for rmatch in NOTICE_REGEXP.finditer(mobj, 0, length)
+            )
+        finally:
+            mobj.close()
+
+
 def read_file(fname):
     """Read file in Python 2 or Python 3."""
     try:
@@ -27,10 +86,10 @@ def read_file(fname):
             return fobj.readlines()
 
 
-def update_copyright_notice():
+def update_copyright_notice(num_jobs=1):
     """Update copyright notice in project files."""
+    # pylint: disable=R0914
     pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    regexp = re.compile(".*Copyright \\(c\\) 2013-(\\d\\d\\d\\d) Pablo Acosta-Serafini")
     ext_exclude = [
         "pyc",
         "png",
@@ -48,35 +107,59 @@ def update_copyright_notice():
         ".tox",
         ".eggs",
         ".cache",
+        ".pypkg_cache",
         os.path.join("docs", "_build"),
         pypkg.functions.get_pkg_name() + ".egg-info",
         ".git",
     ]
     year = datetime.datetime.now().year
-    template = "Copyright (c) 2013-{0} Pablo Acosta-Serafini"
-    header_printed = False
-    for fname in pypkg.functions.dir_tree(pkg_dir, dir_exclude, ext_exclude):
-        lines = read_file(fname)
-        ret = []
-        save_file = False
-        for line in lines:
-            rmatch = regexp.match(line)
-            if rmatch:
-                file_year = int(rmatch.group(1))
-                if file_year != year:
-                    save_file = True
-                    line = line.replace(
-                        template.format(file_year), template.format(year)
-                    )
-            ret.append(line)
-        if save_file:
-            if not header_printed:
-                header_printed = True
-                print("Updating copyright notice")
+    index = pypkg.functions.read_cache(INDEX_NAME) or {}
+    known = index.get("files", {}) if index.get("year", None) == year else {}
+    files = {}
+    fnames = []
+    # Untracked files ignored by Git (build output, virtual environments,
+    # etc.) are not walked
+    for fname in pypkg.functions.iter_tree(
+        pkg_dir, dir_exclude, ext_exclude, gitignore=True
+    ):
+        key = os.path.relpath(fname, pkg_dir)
+        sig = _file_sig(fname)
+        if known.get(key, None) == sig:
+            files[key] = sig
+        else:
+            fnames.append(fname)
+    # Files reachable through symbolic links are only updated once
+    real_fnames = {}
+    for fname in fnames:
+        real_fnames.setdefault(os.path.realpath(fname), fname)
+    items = sorted(real_fnames.values())
+    if (num_jobs > 1) and (len(items) > 1):
+        pool = ThreadPool(min(num_jobs, len(items)))
+        try:
+            changed = pool.map(_update_file, [(fname, year) for fname in items])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        changed = [_update_file((fname, year)) for fname in items]
+    changed = sorted(fname for fname, fchanged in zip(items, changed) if fchanged)
+    if changed:
+        print("Updating copyright notice")
+        for fname in changed:
             print("   File {0}".format(fname))
-            with open(fname, "w") as fobj:
-                fobj.write("".join(ret))
+    for fname in fnames:
+        files[os.path.relpath(fname, pkg_dir)] = _file_sig(fname)
+    pypkg.functions.write_cache(INDEX_NAME, {"year": year, "files": files})
 
 
 if __name__ == "__main__":
-    update_copyright_notice()
+    PARSER = argparse.ArgumentParser(description="Update copyright notice")
+    PARSER.add_argument(
+        "-j",
+        "--jobs",
+        help="number of files processed concurrently (default: 1)",
+        type=int,
+        default=1,
+    )
+    ARGS = PARSER.parse_args()
+    update_copyright_notice(ARGS.jobs)